@@ -0,0 +1,206 @@
+"""
+Throughput benchmark for the encrypt/decrypt functions in
+persona_server/encryption.py (also used by cassidy_adk).
+
+Measures ops/sec and p50/p99 latency across payload sizes (short chat line vs
+10 KB journal entry), history lengths, v1 vs v2 envelopes and cold vs warm
+derived-key cache, and prints the results as JSON so runs can be compared
+across releases.
+
+Usage:
+    python benchmarks/encryption_bench.py
+    python benchmarks/encryption_bench.py --lengths 10,100 --output bench.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = {
+    "persona_server": os.path.join(BACKEND_DIR, "persona_server", "encryption.py"),
+}
+
+PAYLOADS = {
+    "chat_line": "I have been feeling a bit anxious about work this week.",
+    "journal_10kb": ("Today I wrote about how the day went and what I noticed. " * 180)[:10240],
+}
+
+ENCRYPTION_KEY = "benchmark.user@example.com"
+
+
+def load_module(name, path):
+    # The module's own flat imports (e.g. encryption -> cache) resolve next to it
+    module_dir = os.path.dirname(path)
+    if module_dir not in sys.path:
+        sys.path.append(module_dir)
+    spec = importlib.util.spec_from_file_location(f"bench_{name}_encryption", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+LABELS = ("module", "operation", "format", "payload", "history_length", "cache")
+
+
+def summarize(samples, total_seconds, ops, **labels):
+    return {
+        **{label: labels.get(label) for label in LABELS},
+        "ops": ops,
+        "seconds": round(total_seconds, 6),
+        "ops_per_sec": round(ops / total_seconds, 2) if total_seconds else None,
+        "p50_ms": round(percentile(samples, 50) * 1000, 4) if samples else None,
+        "p99_ms": round(percentile(samples, 99) * 1000, 4) if samples else None,
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4) if samples else None,
+    }
+
+
+def reset_caches(module):
+    module.key_cache.clear()
+    if hasattr(module, "data_key_cache"):
+        module.data_key_cache.clear()
+
+
+def time_calls(fn, items):
+    samples = []
+    start = time.perf_counter()
+    for item in items:
+        call_start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - call_start)
+    return samples, time.perf_counter() - start
+
+
+def bench_encrypt(module_name, module, payload_name, payload, fmt, data_keys, key_id, ops):
+    if fmt == "v2":
+        fn = lambda _: module.encrypt(payload, ENCRYPTION_KEY, data_keys, key_id)
+    else:
+        fn = lambda _: module.encrypt(payload, ENCRYPTION_KEY)
+    samples, total = time_calls(fn, range(ops))
+    return summarize(
+        samples, total, ops,
+        module=module_name, operation="encrypt", format=fmt, payload=payload_name,
+        history_length=None, cache=None,
+    )
+
+
+def bench_decrypt(module_name, module, payload_name, fmt, history, data_keys):
+    results = []
+    labels = dict(module=module_name, format=fmt, payload=payload_name, history_length=len(history))
+    decrypt_one = lambda blob: module.decrypt(blob, ENCRYPTION_KEY, data_keys)
+
+    # Per-call latency, cold then warm key cache
+    reset_caches(module)
+    samples, total = time_calls(decrypt_one, history)
+    results.append(summarize(samples, total, len(history), operation="decrypt", cache="cold", **labels))
+    samples, total = time_calls(decrypt_one, history)
+    results.append(summarize(samples, total, len(history), operation="decrypt", cache="warm", **labels))
+
+    # Whole-history batch through decrypt_many, cold then warm
+    for cache in ("cold", "warm"):
+        if cache == "cold":
+            reset_caches(module)
+        start = time.perf_counter()
+        module.decrypt_many(history, ENCRYPTION_KEY, data_keys=data_keys)
+        total = time.perf_counter() - start
+        results.append(summarize([total], total, len(history), operation="decrypt_many", cache=cache, **labels))
+
+    return results
+
+
+def build_history(module, payload, fmt, length, data_keys, key_id):
+    if fmt == "v2":
+        return [module.encrypt(payload, ENCRYPTION_KEY, data_keys, key_id) for _ in range(length)]
+    return [module.encrypt(payload, ENCRYPTION_KEY) for _ in range(length)]
+
+
+def run(module_names, lengths, formats, encrypt_ops):
+    modules = {name: load_module(name, MODULES[name]) for name in module_names}
+    # Fixtures are built once with the first module (all share the wire
+    # format) and sliced for shorter histories.
+    builder = next(iter(modules.values()))
+    key_id, wrapped_key = builder.create_data_key(ENCRYPTION_KEY)
+    data_keys = {key_id: wrapped_key}
+
+    fixtures = {}
+    for payload_name, payload in PAYLOADS.items():
+        for fmt in formats:
+            print(f"Building {max(lengths)} {fmt} {payload_name} fixtures...", file=sys.stderr)
+            fixtures[(payload_name, fmt)] = build_history(builder, payload, fmt, max(lengths), data_keys, key_id)
+
+    results = []
+    for module_name, module in modules.items():
+        for payload_name, payload in PAYLOADS.items():
+            for fmt in formats:
+                print(f"[{module_name}] {payload_name} {fmt}", file=sys.stderr)
+                results.append(bench_encrypt(module_name, module, payload_name, payload, fmt, data_keys, key_id, encrypt_ops))
+                for length in lengths:
+                    history = fixtures[(payload_name, fmt)][:length]
+                    results.extend(bench_decrypt(module_name, module, payload_name, fmt, history, data_keys))
+    return results
+
+
+def environment_info():
+    try:
+        import cryptography
+        cryptography_version = cryptography.__version__
+    except ImportError:
+        cryptography_version = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cryptography": cryptography_version,
+        "decrypt_pool": os.getenv("DECRYPT_POOL", "thread"),
+        "decrypt_workers": os.getenv("DECRYPT_WORKERS"),
+        "key_cache_size": os.getenv("ENCRYPTION_KEY_CACHE_SIZE"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encrypt/decrypt throughput")
+    parser.add_argument("--modules", default=",".join(MODULES), help="comma-separated modules to benchmark")
+    parser.add_argument("--lengths", default="10,100,1000,5000", help="comma-separated history lengths")
+    parser.add_argument("--formats", default="v1,v2", help="comma-separated envelope formats")
+    parser.add_argument("--encrypt-ops", type=int, default=50, help="encrypt calls per case")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    lengths = sorted(int(length) for length in args.lengths.split(","))
+    # Every v1 message has its own salt, so a warm pass only hits the
+    # derived-key cache if it holds the whole history (the modules read the
+    # size when they are loaded)
+    key_cache_size = int(os.getenv("ENCRYPTION_KEY_CACHE_SIZE", "4096"))
+    if key_cache_size <= max(lengths):
+        print(f"Raising ENCRYPTION_KEY_CACHE_SIZE from {key_cache_size} to {max(lengths) + 16} "
+              f"so warm runs of {max(lengths)} messages stay cached", file=sys.stderr)
+        os.environ["ENCRYPTION_KEY_CACHE_SIZE"] = str(max(lengths) + 16)
+    report = {
+        "benchmark": "encryption",
+        "environment": environment_info(),
+        "results": run(args.modules.split(","), lengths, args.formats.split(","), args.encrypt_ops),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Seeds a local SQLite database with realistic user data and benchmarks the
+storage read/write paths used by persona_server and cassidy_adk.
+
+Every seeded user gets an encrypted chat history ({encryptedMessage, role}
+entries), encrypted journal entries, a persona and a current question, in the
+same shape the web app writes to Firestore. Values use v2 envelopes with one
+data key per user, so seeding does not pay PBKDF2 for every message.
+
+The seeded file can be served by both servers for end-to-end load tests:
+
+    python benchmarks/storage_bench.py --db /tmp/soulscript.db --users 50 --messages 2000
+    STORAGE_BACKEND=sqlite STORAGE_SQLITE_PATH=/tmp/soulscript.db uvicorn main:app
+    STORAGE_BACKEND=sqlite STORAGE_SQLITE_PATH=/tmp/soulscript.db python main.py   # cassidy_adk
+
+Usage:
+    python benchmarks/storage_bench.py --db bench.db --users 20 --messages 1000 --journal 60
+    python benchmarks/storage_bench.py --db bench.db --no-seed --output storage.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERSONA_SERVER_DIR = os.path.join(BACKEND_DIR, "persona_server")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from encryption_bench import summarize, time_calls  # noqa: E402
+
+CHAT_LINES = [
+    "I have been feeling a bit anxious about work this week.",
+    "Sleep has been better since I started going for walks in the evening.",
+    "My sister called and we talked for an hour, it helped a lot.",
+    "I keep replaying the meeting in my head and it makes me tense.",
+]
+JOURNAL_TEXT = "Today I wrote about how the day went and what I noticed. "
+
+
+def load_module(name, path):
+    # The module's own flat imports (e.g. encryption -> cache) resolve next to it
+    module_dir = os.path.dirname(path)
+    if module_dir not in sys.path:
+        sys.path.append(module_dir)
+    spec = importlib.util.spec_from_file_location(f"bench_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def user_id(index):
+    return f"bench-user-{index:05d}"
+
+
+def seed(storage, encryption, users, messages, journal):
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    for index in range(users):
+        authId = user_id(index)
+        email = f"{authId}@example.com"
+        key_id, wrapped_key = encryption.create_data_key(email)
+        data_keys = {key_id: wrapped_key}
+
+        storage.update_user(authId, {
+            "email": email,
+            "dataKeys": data_keys,
+            "dataKeyId": key_id,
+            "updatePersona": True,
+            "currentQuestion": {"questionTheme": "General", "questionIndex": 0, "questionText": "How are you?"},
+        })
+        history = [
+            {
+                "encryptedMessage": encryption.encrypt(rng.choice(CHAT_LINES), email, data_keys, key_id),
+                "role": "user" if position % 2 == 0 else "assistant",
+            }
+            for position in range(messages)
+        ]
+        storage.append_history(authId, history)
+
+        for position in range(journal):
+            storage.add_journal_entry(authId, f"entry-{position:05d}", {
+                "encryptedTitle": encryption.encrypt(f"Day {position}", email, data_keys, key_id),
+                "encryptedContent": encryption.encrypt(JOURNAL_TEXT * rng.randint(5, 40), email, data_keys, key_id),
+                "date": now - timedelta(days=journal - position),
+                "createdAt": now,
+                "updatedAt": now,
+            })
+
+        storage.write_persona(authId, json.dumps({"Info": {}, "Graph": {}}), {"updatePersona": False})
+        print(f"Seeded {authId}", file=sys.stderr)
+
+
+def run(storage_module, storage, users, rounds):
+    ids = [user_id(index) for index in range(users)] * rounds
+    user_data = {authId: storage.get_user(authId) for authId in set(ids)}
+    # Incremental persona refreshes only read the last few messages
+    tail_start = {authId: max(0, storage_module.history_length(data) - 20) for authId, data in user_data.items()}
+
+    cases = {
+        "get_user": lambda authId: storage.get_user(authId),
+        "get_user_projected": lambda authId: storage.get_user(authId, field_paths=["updatePersona"]),
+        "load_history_full": lambda authId: storage.load_history(authId, user_data[authId]),
+        "load_history_tail": lambda authId: storage.load_history(authId, user_data[authId], start_index=tail_start[authId]),
+        "get_journal_entries_5": lambda authId: storage.get_journal_entries(authId, 5),
+        "get_journal_entries_30": lambda authId: storage.get_journal_entries(authId, 30),
+        "get_persona": lambda authId: storage.get_persona(authId),
+        "get_current_question": lambda authId: storage.get_current_question(authId),
+        "write_persona": lambda authId: storage.write_persona(authId, "{}", {"updatePersona": False}),
+    }
+
+    results = []
+    for operation, fn in cases.items():
+        print(f"[{storage.backend}] {operation}", file=sys.stderr)
+        samples, total = time_calls(fn, ids)
+        results.append({"backend": storage.backend, **summarize(samples, total, len(ids), operation=operation)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a SQLite store and benchmark the storage layer")
+    parser.add_argument("--db", default="bench.db", help="SQLite database file")
+    parser.add_argument("--users", type=int, default=20, help="users to seed / read")
+    parser.add_argument("--messages", type=int, default=1000, help="chat messages per user")
+    parser.add_argument("--journal", type=int, default=60, help="journal entries per user")
+    parser.add_argument("--rounds", type=int, default=5, help="passes over all users per operation")
+    parser.add_argument("--no-seed", action="store_true", help="benchmark an already seeded database")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    storage_module = load_module("storage", os.path.join(PERSONA_SERVER_DIR, "storage.py"))
+    encryption = load_module("encryption", os.path.join(PERSONA_SERVER_DIR, "encryption.py"))
+    storage = storage_module.create_storage("sqlite", sqlite_path=args.db)
+
+    if not args.no_seed:
+        seed(storage, encryption, args.users, args.messages, args.journal)
+
+    report = {
+        "benchmark": "storage",
+        "environment": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "db": os.path.abspath(args.db),
+            "users": args.users,
+            "messages": args.messages,
+            "journal": args.journal,
+        },
+        "results": run(storage_module, storage, args.users, args.rounds),
+    }
+    storage.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
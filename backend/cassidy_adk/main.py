@@ -6,6 +6,10 @@ from next_ques_agent.tools import FirebaseQuestionManager
 from dotenv import load_dotenv
 from next_ques_agent.agent import analyze_user_response
 from progress_agent.agent import track_progress
+# Shared with persona_server (made importable by next_ques_agent)
+from llm_gateway import llm_gateway
+from llm_routing import task_router
+from prompt_builder import prompt_metrics
 import json
 
 load_dotenv()  # Load environment variables from .env file
@@ -82,6 +86,16 @@ def health_check():
     )
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """LLM gateway counters, per-task latency / token usage and prompt sizes"""
+    return jsonify({
+        "llm_gateway": llm_gateway.stats(),
+        "llm_tasks": task_router.stats(),
+        "prompts": prompt_metrics.stats(),
+    })
+
+
 @app.route("/track_progress", methods=["POST"])
 async def track_progress_route():
     """
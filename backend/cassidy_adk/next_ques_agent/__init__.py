@@ -1 +1,14 @@
+import os
+import sys
+
+# storage, encryption and the LLM gateway, routing and prompt modules are
+# shared with persona_server and imported from its directory, so both
+# servers run the same code. Inserted after the script directory, so this
+# app's own modules still come first.
+SHARED_MODULES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "persona_server"
+)
+if SHARED_MODULES_DIR not in sys.path:
+    sys.path.insert(1, SHARED_MODULES_DIR)
+
 from . import agent
@@ -4,16 +4,15 @@ from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
 from .tools import get_next_question, get_current_question
+from .gateway_model import GatewayGemini
 from dotenv import load_dotenv
 
 load_dotenv()
 
-GEMINI_MODEL = "gemini-2.0-flash"
-
 
 follow_up_generator = LlmAgent(
     name="followUpAgent",
-    model=GEMINI_MODEL,
+    model=GatewayGemini.for_task("follow_up"),
     instruction="""
 You are a follow-up question generator AI. The user has answered a question asked by the therapist, but not completely. Your task is to generate a follow-up question based on the user's answer to a therapy question. 
 """,
@@ -23,7 +22,7 @@ You are a follow-up question generator AI. The user has answered a question aske
 
 answer_reviewer_agent = LlmAgent(
     name="AnswerReviewerAgent",
-    model=GEMINI_MODEL,
+    model=GatewayGemini.for_task("answer_review"),
     instruction="""
 You are a helper agent to a mental therapist. The mental therapist has asked the user some question, and the user has provided an answer. Your task is to review the user's answer and tell if the answer is complete or not. That is, you have to check if the user has answered all parts of the question asked by the therapist.
 If the answer is not complete, call the follow_up_generator agent tool to generate a follow-up question based on the user's answer. Provide the therapist's question and user's answer as it is to the follow_up_generator tool (provide it as a single string).
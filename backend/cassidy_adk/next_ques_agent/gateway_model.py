@@ -0,0 +1,48 @@
+import time
+from typing import Optional
+
+from google.adk.models import Gemini
+from google.genai import types
+
+from llm_gateway import PRIORITY_INTERACTIVE, llm_gateway
+from llm_routing import task_router
+
+
+class GatewayGemini(Gemini):
+    """
+    Gemini model for ADK agents whose requests go through the process-wide
+    LLM gateway (concurrency cap, rate limit, retries and deadline), so the
+    agents share one quota budget instead of each calling Gemini directly.
+
+    With a `task`, the model, output cap, temperature and deadline come from
+    the task's route and the call's latency and tokens are recorded for it.
+    """
+
+    task: Optional[str] = None
+
+    @classmethod
+    def for_task(cls, task):
+        """Model routed for a task, e.g. GatewayGemini.for_task("answer_review")"""
+        return cls(model=task_router.model(task), task=task)
+
+    async def generate_content_async(self, llm_request, stream=False):
+        if self.task:
+            llm_request.config = task_router.config(self.task, llm_request.config or types.GenerateContentConfig())
+
+        parent = super(GatewayGemini, self)
+        started = time.monotonic()
+        last_response = None
+        try:
+            async for response in llm_gateway.astream(
+                lambda: parent.generate_content_async(llm_request, stream),
+                model=llm_request.model or self.model,
+                key="adk",
+                priority=PRIORITY_INTERACTIVE,
+                deadline=task_router.deadline(self.task),
+            ):
+                last_response = response
+                yield response
+        except Exception:
+            task_router.record_error(self.task)
+            raise
+        task_router.record(self.task, time.monotonic() - started, getattr(last_response, "usage_metadata", None))
@@ -2,7 +2,8 @@ import json
 import firebase_admin
 from firebase_admin import credentials, firestore
 from typing import Dict, Optional, Any
-from .encryption import decrypt
+from encryption import decrypt_history
+from storage import STORAGE_BACKEND, create_storage
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -12,14 +13,15 @@ class FirebaseQuestionManager:
 
     def __init__(self, credentials_path: str = None, questions_json_path: str = None):
 
-        if not firebase_admin._apps:
+        # Firestore in production; STORAGE_BACKEND=sqlite runs offline
+        if STORAGE_BACKEND == "firestore" and not firebase_admin._apps:
             if credentials_path:
                 cred = credentials.Certificate(credentials_path)
                 firebase_admin.initialize_app(cred)
             else:
                 firebase_admin.initialize_app()
 
-        self.db = firestore.client()
+        self.storage = create_storage(firestore_client=firestore.client)
         self.questions_data = {}
 
         if questions_json_path:
@@ -37,8 +39,7 @@ class FirebaseQuestionManager:
             bool: True if successful, False otherwise
         """
         try:
-            user_ref = self.db.collection("users").document(userId)
-            user_ref.update({"progress": progress})
+            self.storage.update_progress(userId, progress)
             print(f"Updated progress for user {userId}")
             return True
         except Exception as e:
@@ -56,13 +57,13 @@ class FirebaseQuestionManager:
             Optional[list]: The user's decrypted message history or None if not found
         """
         try:
-            user_ref = self.db.collection("users").document(userId)
-            user_doc = user_ref.get()
+            user_data = self.storage.get_user(userId)
 
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                user_history = user_data.get("userHistory", [])
+            if user_data is not None:
+                # userHistory array or the paginated messages subcollection
+                user_history = self.storage.load_history(userId, user_data)
                 user_email = user_data.get("email")
+                data_keys = user_data.get("dataKeys")
 
                 if not user_email:
                     print(f"User email not found for user {userId} - required for decryption")
@@ -75,26 +76,7 @@ class FirebaseQuestionManager:
                     return user_history
 
 
-                decrypted_user_history = []
-                for entry in user_history:
-                    if isinstance(entry, dict):
-                        decrypted_entry = {}
-                        for key, value in entry.items():
-                            if key == 'encryptedMessage' and value and user_email:
-                                try:
-                                    decrypted_message = decrypt(value, user_email)
-                                    decrypted_entry['message'] = decrypted_message
-                                except Exception as e:
-                                    print(f"Failed to decrypt message for user {userId}: {e}")
-                                    decrypted_entry['message'] = "[ENCRYPTED_DATA_COULD_NOT_DECRYPT]"
-                            else:
-                                decrypted_entry[key] = value
-                                
-                        decrypted_user_history.append(decrypted_entry)
-                    else:
-                        decrypted_user_history.append(entry)
-
-                return decrypted_user_history
+                return decrypt_history(user_history, user_email, data_keys)
 
             return None
 
@@ -120,20 +102,15 @@ class FirebaseQuestionManager:
     def getCurrentQuestion(self, userId: str) -> Optional[Dict[str, Any]]:
 
         try:
-            # Get user document from Firebase
-            user_ref = self.db.collection("users").document(userId)
-            user_doc = user_ref.get()
+            # Reads only the currentQuestion field, not the whole user document
+            current_question = self.storage.get_current_question(userId)
 
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                current_question = user_data.get("currentQuestion")
-
-                if current_question:
-                    return {
-                        "questionTheme": current_question.get("questionTheme"),
-                        "questionIndex": current_question.get("questionIndex"),
-                        "questionText": current_question.get("questionText"),
-                    }
+            if current_question:
+                return {
+                    "questionTheme": current_question.get("questionTheme"),
+                    "questionIndex": current_question.get("questionIndex"),
+                    "questionText": current_question.get("questionText"),
+                }
 
             return None
 
@@ -182,8 +159,7 @@ class FirebaseQuestionManager:
             }
 
             # Update Firebase with new current question
-            user_ref = self.db.collection("users").document(userId)
-            user_ref.update({"currentQuestion": next_question})
+            self.storage.set_current_question(userId, next_question, must_exist=True)
 
             print(
                 f"Updated user {userId} to question {next_index} in theme '{current_theme}'"
@@ -219,8 +195,7 @@ class FirebaseQuestionManager:
             }
 
             # Update Firebase
-            user_ref = self.db.collection("users").document(userId)
-            user_ref.set({"currentQuestion": current_question}, merge=True)
+            self.storage.set_current_question(userId, current_question)
 
             print(
                 f"Set current question for user {userId}: theme '{questionTheme}', index {questionIndex}"
@@ -5,13 +5,13 @@ from google.adk.sessions import InMemorySessionService
 from google.genai import types
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from next_ques_agent.gateway_model import GatewayGemini
+from prompt_builder import build_prompt, compact_json
 import json
 import os
 
 load_dotenv()
 
-GEMINI_MODEL = "gemini-2.0-flash"
-
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -25,10 +25,10 @@ with open(questions_json_path, "r", encoding="utf-8") as file:
     questions_data = json.load(file)
 progress_agent = LlmAgent(
     name="ProgressAgent",
-    model=GEMINI_MODEL,
+    model=GatewayGemini.for_task("progress"),
     instruction=f"""You are a progress tracking AI for a mental health therapy application. Your task is to analyze a set of questions and a conversation between a user and therapist, and determine the number of questions asked by the therapist and completely answered by the user. If same question is asked multiple times, it should be counted only once if answered completely. Also questions are asked serially, so if a question is not answered, any question after that should not be counted as answered.
 
-    Full Question Set: {questions_data}
+    Full Question Set: {compact_json(questions_data)}
 
     Return only in the following format:
     {{
@@ -74,8 +74,7 @@ async def call_agent(query):
 async def track_progress(user_id, message_history):
     # load questions_flat.json as questions
 
-    query = f"""
-therapist user conversation: {message_history} 
-"""
+    # Not truncated: answered questions are counted from the start of the conversation
+    query = build_prompt("progress", "\ntherapist user conversation: ", message_history) + "\n"
     res = await call_agent(query)
     return res
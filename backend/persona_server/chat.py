@@ -1,17 +1,35 @@
 import os
+import time
 from google import genai
 from google.genai import types
+from llm_clients import llm_clients
+from llm_gateway import PRIORITY_INTERACTIVE, agenerate_content_stream
+from llm_routing import task_router
 
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "hackathons-423418-ca6c603344c4.json"
-def reflection_chatbot(user_info=None, user_message=None):
-    client = genai.Client(
-        vertexai=True,
-        project="hackathons-423418",
-        location="us-central1",  # Make sure this matches your RAG corpus location
-    )
+async def reflection_chatbot(user_info=None, user_message=None):
+    """Return the complete chatbot reply as one string"""
+    response_text = ""
+    async for text in stream_reflection_chatbot(user_info=user_info, user_message=user_message):
+        response_text += text
+    return response_text
+
+
+async def stream_reflection_chatbot(user_info=None, user_message=None, metadata=None):
+    """
+    Yield the chatbot reply text chunk by chunk as the model streams it.
 
-    model = "gemini-2.0-flash"  # Use a supported Gemini model
+    Args:
+        user_info (str): The user's persona JSON
+        user_message (str): The message to answer
+        metadata (dict): Optional dict filled in once the stream ends with
+            the model, finish reason and token usage
+    """
+    # Shared Vertex AI client (needed for the RAG corpus tool)
+    client = llm_clients.vertex_client()
+
+    model = task_router.model("chat")
 
     # Format user inputs into the system prompt
     system_prompt = f"""From now on, you will take on the persona of a compassionate and skilled therapist, dedicated to providing a safe, supportive, and nonjudgmental space for personal growth. Your role is to help me explore my thoughts, emotions, and behaviors, offering guidance that aligns with my values and goals. You use a client-centered, evidence-based approach, tailoring your responses to my unique needs.
@@ -49,10 +67,9 @@ User Message:
     ]
 
     # Generation configuration
-    generate_content_config = types.GenerateContentConfig(
-        temperature=0.7,
+    # Temperature and output cap come from the chat route
+    generate_content_config = task_router.config("chat", types.GenerateContentConfig(
         top_p=1,
-        max_output_tokens=8000,
         seed=456,
         safety_settings=[
             types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
@@ -61,17 +78,38 @@ User Message:
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
         ],
         tools=tools,
-    )
+    ))
 
-    # Collect response from model stream
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if chunk.candidates and chunk.candidates[0].content:
-            for part in chunk.candidates[0].content.parts:
-                response_text += part.text
-    
-    return response_text
+    # Forward the model stream as it arrives
+    last_chunk = None
+    started = time.monotonic()
+    try:
+        async for chunk in agenerate_content_stream(
+            client,
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+            priority=PRIORITY_INTERACTIVE,
+            deadline=task_router.deadline("chat"),
+        ):
+            last_chunk = chunk
+            if chunk.candidates and chunk.candidates[0].content:
+                for part in chunk.candidates[0].content.parts:
+                    if part.text:
+                        yield part.text
+    except Exception:
+        task_router.record_error("chat")
+        raise
+    task_router.record("chat", time.monotonic() - started, getattr(last_chunk, "usage_metadata", None))
+
+    if metadata is not None:
+        metadata["model"] = model
+        if last_chunk is not None and last_chunk.candidates and last_chunk.candidates[0].finish_reason:
+            metadata["finish_reason"] = str(last_chunk.candidates[0].finish_reason)
+        usage = last_chunk.usage_metadata if last_chunk is not None else None
+        if usage is not None:
+            metadata["usage"] = {
+                "prompt_tokens": usage.prompt_token_count,
+                "output_tokens": usage.candidates_token_count,
+                "total_tokens": usage.total_token_count,
+            }
@@ -3,20 +3,21 @@ from dotenv import load_dotenv
 from google import genai
 import json
 import re
+import time
 import pandas as pd
 from google import genai
 from google.genai import types
+from llm_clients import llm_clients
+from llm_cache import agenerate_content_cached, parses_as_json
+from llm_gateway import agenerate_content_stream
+from llm_hedging import hedge_policy
+from llm_routing import task_router
+from prompt_builder import build_prompt, compact_json, estimate_tokens, prompt_metrics, serialize, truncate_text
 
 
 
 # Load environment variables from .env file
 load_dotenv()
-
-# Read the API key from the environment
-api_key = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
-
-# Initialize the genai client with the API key
-client = genai.Client(api_key=api_key)
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "secrets/hackathons-423418-ca6c603344c4.json"
 
@@ -26,7 +27,20 @@ EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
 # Initialize Gemini client with API key from environment
 # client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
-def extract_information_gemini(json_data):
+PREVIOUS_EXTRACTION_NOTE = """
+# Previous extraction
+The JSON below was extracted from this user's earlier profile. Start from it:
+keep its field names and values where the new input does not contradict them,
+update the values the new input changes, and add any new fields.
+
+"""
+
+def previous_extraction_section(previous):
+    if not previous:
+        return ""
+    return PREVIOUS_EXTRACTION_NOTE + compact_json(previous) + "\n\n# New input:\n"
+
+async def extract_information_gemini(json_data, previous_info=None):
     prompt = """
 ```
 #role  
@@ -97,13 +111,20 @@ Extract relevant information from the provided JSON and return the data strictly
         
     
     #
-    prompt += json.dumps(json_data, indent=2)
+    prompt = build_prompt(
+        "info_extraction",
+        prompt + previous_extraction_section(previous_info),
+        json_data,
+        budget=task_router.input_budget("info_extraction"),
+    )
 
     # Use the correct Gemini model
       
-    response = client.models.generate_content(
-    model="gemini-2.0-flash",
+    response = await agenerate_content_cached(
+    llm_clients.api_key_client(),
     contents=prompt,
+    task="info_extraction",
+    cacheable=parses_as_json,
       )
 
     extracted_data=response.text
@@ -116,7 +137,7 @@ Extract relevant information from the provided JSON and return the data strictly
           return extracted_data
     return {}
 
-def extract_graph_info(json_data):
+async def extract_graph_info(json_data, previous_graph=None):
     # Extract graph information from the JSON data
   
     prompt = """
@@ -162,14 +183,21 @@ Extract all relevant information that relates to **self-perception**, **relation
 
 
 
-    prompt += json.dumps(json_data, indent=4)
+    prompt = build_prompt(
+        "graph_extraction",
+        prompt + previous_extraction_section(previous_graph),
+        json_data,
+        budget=task_router.input_budget("graph_extraction"),
+    )
 
     # Use the correct Gemini model
   
         
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
+    response = await agenerate_content_cached(
+        llm_clients.api_key_client(),
         contents=prompt,
+        task="graph_extraction",
+        cacheable=parses_as_json,
     )
 
     extracted_data=response.text
@@ -187,23 +215,39 @@ Extract all relevant information that relates to **self-perception**, **relation
 
 
 
-def generate_rag(chat_data=None, journal_analysis=None):
-    client = genai.Client(
-        vertexai=True,
-        project="hackathons-423418",
-        location="us-central1",  # Make sure this matches your RAG corpus location
-    )
+async def generate_rag(chat_data=None, journal_analysis=None, previous_profile=None):
+    # Shared Vertex AI client (needed for the RAG corpus tool)
+    client = llm_clients.vertex_client()
 
-    model = "gemini-2.0-flash"  # Use a supported Gemini model
+    model = task_router.model("rag_profile")
+
+    # For incremental refreshes the chat/journal data only covers activity
+    # since the previous profile, which is passed in as the starting point.
+    previous_section = ""
+    if previous_profile:
+        previous_section = f"""
+# PREVIOUS PROFILE
+{compact_json(previous_profile)}
+
+The chat data and journal analysis below only cover the user's activity since this profile was built. Update the profile with them: keep conclusions that still hold, revise those the new data changes, and add anything new.
+"""
+
+    # Chat data and journal analysis each get half of the input budget
+    budget = task_router.input_budget("rag_profile")
+    section_budget = budget // 2 if budget else None
+    chat_section = truncate_text(serialize(chat_data), section_budget) if chat_data else "No chat data provided."
+    journal_section = (
+        truncate_text(serialize(journal_analysis), section_budget) if journal_analysis else "No journal analysis provided."
+    )
 
     # Format user inputs into the system prompt
     system_prompt = f"""You are an advanced mental health reasoning agent tasked with developing a comprehensive psychological profile based on user data.
-
+{previous_section}
 # USER CHAT DATA
-{chat_data if chat_data else "No chat data provided."}
+{chat_section}
 
 # JOURNAL ANALYSIS
-{journal_analysis if journal_analysis else "No journal analysis provided."}
+{journal_section}
 
 Using all the information above, create a detailed psychological profile with the following components:
 
@@ -218,6 +262,8 @@ For each section, detail your reasoning process and highlight any uncertainties
 Format the output as JSON with these sections as keys.
 """
 
+    prompt_metrics.record("rag_profile", estimate_tokens(system_prompt))
+
     # Create prompt content
     contents = [
         types.Content(
@@ -244,10 +290,9 @@ Format the output as JSON with these sections as keys.
     ]
 
     # Generation configuration
-    generate_content_config = types.GenerateContentConfig(
-        temperature=0.7,
+    # Temperature and output cap come from the rag_profile route
+    generate_content_config = task_router.config("rag_profile", types.GenerateContentConfig(
         top_p=1,
-        max_output_tokens=4000,
         seed=456,
         safety_settings=[
             types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
@@ -256,17 +301,31 @@ Format the output as JSON with these sections as keys.
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
         ],
         tools=tools,
-    )
+    ))
 
     # Collect response from model stream
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if chunk.candidates and chunk.candidates[0].content:
-            for part in chunk.candidates[0].content.parts:
-                response_text += part.text
-    
+    async def collect(model_name):
+        response_text = ""
+        last_chunk = None
+        async for chunk in agenerate_content_stream(
+            client,
+            model=model_name,
+            contents=contents,
+            config=generate_content_config,
+            deadline=task_router.deadline("rag_profile"),
+        ):
+            last_chunk = chunk
+            if chunk.candidates and chunk.candidates[0].content:
+                for part in chunk.candidates[0].content.parts:
+                    response_text += part.text
+        return response_text, last_chunk
+
+    # A slow profile generation stalls /getReport; hedge it if enabled
+    started = time.monotonic()
+    try:
+        response_text, last_chunk = await hedge_policy.arun("rag_profile", model, collect)
+    except Exception:
+        task_router.record_error("rag_profile")
+        raise
+    task_router.record("rag_profile", time.monotonic() - started, getattr(last_chunk, "usage_metadata", None))
     return response_text
\ No newline at end of file
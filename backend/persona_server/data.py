@@ -2,9 +2,6 @@ import os
 from dotenv import load_dotenv
 from google import genai
 import json
-import firebase_admin
-from firebase_admin import credentials
-from google.cloud import firestore
 import re
 import pandas as pd
 from reportlab.lib.units import inch
@@ -22,9 +19,6 @@ import os
 from dotenv import load_dotenv
 from google import genai
 import json
-import firebase_admin
-from firebase_admin import credentials
-from google.cloud import firestore
 import re
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -38,24 +32,38 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Page
 from math import pi
 from datetime import datetime
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
-from encryption import decrypt
+from encryption import decrypt_many, decrypt_history
+from repository import storage
+from journal_cache import ANALYSIS_CACHE_FIELD, load_cached_analyses, save_analysis
+from fanout import run_map_bounded
+from google.genai import types
+from pydantic import BaseModel, ValidationError
+from llm_clients import llm_clients
+from llm_cache import generate_content_cached, parses_as_json
+from llm_gateway import PRIORITY_BATCH
+from llm_routing import task_router
+from prompt_builder import build_prompt, estimate_tokens
 # Load environment variables
 load_dotenv()
 
-# Read the API key from the environment
-api_key = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
+# Shared Gemini API-key client (see llm_clients.py). This module runs in
+# worker threads, so it uses the sync surface.
+client = llm_clients.api_key_client()
 
-# Initialize Gemini client with API key from environment
-client = genai.Client(api_key=api_key)
+EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
 
-# Initialize Firebase Admin
-cred = credentials.Certificate("service.json")
-firebase_admin.initialize_app(cred)
+# Number of latest journal entries fed into the persona analysis
+PERSONA_JOURNAL_LIMIT = 5
 
-# Initialize Firestore client using the same credentials
-db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
 
-EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
+# Batched journal analysis: several short entries are analyzed in one call
+# as long as their estimated prompt size stays under the token budget and
+# their expected analyses (JOURNAL_BATCH_OUTPUT_PER_ENTRY tokens each) fit in
+# the batch task's max_output_tokens, so a batch is not cut off mid-JSON
+JOURNAL_BATCH_MODE = os.getenv("JOURNAL_BATCH_MODE", "true").lower() in ("1", "true", "yes")
+JOURNAL_BATCH_TOKEN_BUDGET = int(os.getenv("JOURNAL_BATCH_TOKEN_BUDGET", "6000"))
+JOURNAL_BATCH_MAX_ENTRIES = int(os.getenv("JOURNAL_BATCH_MAX_ENTRIES", "4"))
+JOURNAL_BATCH_OUTPUT_PER_ENTRY = int(os.getenv("JOURNAL_BATCH_OUTPUT_PER_ENTRY", "2000"))
 
 
 def json_to_md(json_data):
@@ -89,14 +97,18 @@ def json_to_md(json_data):
 
 
 
-    """+ json.dumps(json_data, indent=4)
+    """
+    prompt = build_prompt(
+        "markdown_conversion", prompt, json_data, budget=task_router.input_budget("markdown_conversion")
+    )
     
 
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
+        response = generate_content_cached(
+            client,
             contents=prompt,
+            task="markdown_conversion",
         )
         return response.text if response else "Error generating Markdown."
     except Exception as e:
@@ -605,7 +617,18 @@ def enhance_markdown_content(markdown_content):
 
 
 
-def data_chat_extraction(authId, response_format="json"):
+def data_chat_extraction(authId, response_format="json", user_data=None, start_index=0):
+    """
+    Extract structured information from the user's chat history.
+
+    Args:
+        authId (str): User authentication ID
+        response_format (str): "json" to parse the model output, anything else for raw text
+        user_data (dict): Optional user document snapshot shared by the caller.
+            If omitted the document is read from Firestore.
+        start_index (int): Only extract messages from this position on
+            (used for incremental persona refreshes)
+    """
     prompt = """
 **#role**  
 You are an advanced data extraction system designed to process therapy questionnaire responses and convert them into structured JSON format. Your goal is to extract key details while maintaining accuracy, completeness, and logical structuring.  
@@ -634,16 +657,17 @@ You are an advanced data extraction system designed to process therapy questionn
 Input:
 """
 
-    document_id = authId
-    doc_ref = db.collection('users').document(document_id)
-    doc = doc_ref.get()
+    if user_data is None:
+        user_data = storage.get_user(authId)
 
-    if not doc.exists:
-        return {"error": "Document not found"}
+        if user_data is None:
+            return {"error": "Document not found"}
 
-    data = doc.to_dict()
-    user_history = data.get('userHistory')
+    data = user_data
+    # Array or paginated messages subcollection, depending on the user's storage mode
+    user_history = storage.load_history(authId, data, start_index=start_index)
     user_email = data.get('email')
+    data_keys = data.get('dataKeys')
 
     if not user_history:
         return {"error": "User history not found"}
@@ -651,40 +675,23 @@ Input:
     if not user_email:
         return {"error": "User email not found - required for decryption"}
 
-    # Decrypt the user history
-    decrypted_user_history = []
-    
-    for entry in user_history:
-        if isinstance(entry, dict):
-            decrypted_entry = {}
-            for key, value in entry.items():
-                # Check if this field contains encrypted data
-                if key == 'encryptedMessage' and value:
-                    try:
-                        # Decrypt using user's email as encryption key
-                        decrypted_message = decrypt(value, user_email)
-                        decrypted_entry['message'] = decrypted_message
-                    except Exception as e:
-                        print(f"Failed to decrypt message: {e}")
-                        # If decryption fails, mark it as encrypted data that couldn't be decrypted
-                        decrypted_entry['message'] = "[ENCRYPTED_DATA_COULD_NOT_DECRYPT]"
-                else:
-                    # Copy other fields as-is
-                    decrypted_entry[key] = value
-            
-            decrypted_user_history.append(decrypted_entry)
-        else:
-            # If entry is not a dict, keep as-is
-            decrypted_user_history.append(entry)
+    # Decrypt the user history (using user's email as encryption key)
+    decrypted_user_history = decrypt_history(user_history, user_email, data_keys)
 
-    prompt += json.dumps(decrypted_user_history, indent=2)
+    # Oldest messages are dropped first if the history exceeds the budget
+    prompt = build_prompt(
+        "chat_extraction", prompt, history=decrypted_user_history,
+        budget=task_router.input_budget("chat_extraction"),
+    )
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
+    response = generate_content_cached(
+        client,
         contents=prompt,
+        task="chat_extraction",
+        cacheable=parses_as_json,
     )
 
-    response_text = response.candidates[0].content.parts[0].text.strip()
+    response_text = (response.text or "").strip()
     response_text = response_text.replace("```json", "").replace("```", "")
 
     if response_format == "json":
@@ -710,154 +717,385 @@ Input:
 
 import pandas as pd
 import json
-from google.cloud import firestore
 
 
-def analyze_with_llm(prompt, system_prompt="You are an expert psychologist analyzing journal entries."):
-    full_prompt = f"{system_prompt}\n\n{prompt}"
+def decrypt_journal_docs(docs, user_email, data_keys=None, default_title=""):
+    """
+    Decrypts the title and content of a list of journal entry snapshots in one batch.
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[full_prompt],  # <-- must be a list of strings or Part instances
-       
+    Unencrypted entries fall back to their plain `title` / `content` fields, and
+    values that cannot be decrypted are replaced with the
+    [ENCRYPTED_TITLE_COULD_NOT_DECRYPT] / [ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]
+    placeholders.
+
+    Returns:
+        list: (doc, entry_data, title, content) tuples in the original order
+    """
+    rows = [(doc, doc.to_dict()) for doc in docs]
+
+    pending = []
+    for row_index, (_, entry_data) in enumerate(rows):
+        if entry_data.get("encryptedTitle"):
+            pending.append((row_index, "title", entry_data["encryptedTitle"], "[ENCRYPTED_TITLE_COULD_NOT_DECRYPT]"))
+        if entry_data.get("encryptedContent"):
+            pending.append((row_index, "content", entry_data["encryptedContent"], "[ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]"))
+
+    decrypted_values = decrypt_many(
+        [value for _, _, value, _ in pending],
+        user_email,
+        fallback=[placeholder for _, _, _, placeholder in pending],
+        data_keys=data_keys,
     )
+    decrypted = {
+        (row_index, field): value
+        for (row_index, field, _, _), value in zip(pending, decrypted_values)
+    }
 
-    return response.text
+    results = []
+    for row_index, (doc, entry_data) in enumerate(rows):
+        title = decrypted.get((row_index, "title"), entry_data.get("title", default_title))
+        content = decrypted.get((row_index, "content"), entry_data.get("content", ""))
+        results.append((doc, entry_data, title, content))
+    return results
+
+
+class EmotionScores(BaseModel):
+    """Scores between 0 and 1 for each of EMOTIONS"""
+    Joy: float
+    Sadness: float
+    Anger: float
+    Fear: float
+    Surprise: float
+    Disgust: float
+    Neutral: float
+
+
+class EntryAnalysis(BaseModel):
+    """Schema of the single structured LLM call made per journal entry"""
+    analysis: str
+    summary: str
+    emotions: EmotionScores
+
+    def to_result(self):
+        emotions = self.emotions.model_dump()
+        return {
+            "analysis": self.analysis,
+            "summary": self.summary,
+            "emotions": {e: min(1.0, max(0.0, float(emotions[e]))) for e in EMOTIONS},
+        }
 
 
-# Your analysis pipeline
-def analyze_journal_entries(authId):
+class BatchEntryAnalysis(EntryAnalysis):
+    """One entry's result in a batched analysis call"""
+    entry_id: str
+
+
+class BatchAnalysis(BaseModel):
+    """Schema of a batched analysis call"""
+    results: list[BatchEntryAnalysis]
+
+
+ENTRY_ANALYSIS_FIELDS = f"""- "analysis": a concise yet comprehensive analysis with clear bullet points for each category:
+        1. Emotional state (primary and secondary emotions)
+        2. Cognitive patterns (positive/negative, rational/irrational)
+        3. Stress indicators and coping mechanisms
+        4. Notable behavioral patterns
+        5. Key concerns or growth opportunities
+        6. Specific recommendations for improvement
+    - "summary": the 1-2 most important actionable insights the journal writer should pay attention to, as bullet points
+    - "emotions": a score between 0 and 1 for each of these emotions: {EMOTIONS}"""
+
+BATCH_ANALYSIS_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=BatchAnalysis,
+)
+
+ENTRY_ANALYSIS_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=EntryAnalysis,
+)
+
+
+def format_entry_for_prompt(entry):
+    return f"""Entry ID: {entry['entry_id']}
+    Title: {entry['title']}
+    Date: {entry['date']}
+    Content: {entry['content']}"""
+
+
+def batch_entry_limit(max_entries=JOURNAL_BATCH_MAX_ENTRIES, output_per_entry=JOURNAL_BATCH_OUTPUT_PER_ENTRY):
+    """Entries per batch: max_entries, or fewer if their output would not fit"""
+    max_output_tokens = task_router.route("journal_batch_analysis").max_output_tokens
+    if max_output_tokens is None:
+        return max_entries
+    return max(1, min(max_entries, max_output_tokens // output_per_entry))
+
+
+def pack_entry_batches(entries, token_budget=JOURNAL_BATCH_TOKEN_BUDGET, max_entries=None):
+    """
+    Greedily group entries (in order) into batches whose estimated prompt
+    size stays under token_budget and whose expected output fits the batch
+    task's output cap (see batch_entry_limit). An entry larger than the
+    budget gets a batch of its own.
+    """
+    if max_entries is None:
+        max_entries = batch_entry_limit()
+    batches = []
+    current, current_tokens = [], 0
+    for entry in entries:
+        tokens = estimate_tokens(format_entry_for_prompt(entry))
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_entries):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(entry)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_entry_analysis(response):
+    """Validate a structured response, falling back to the JSON in its text"""
+    parsed = getattr(response, "parsed", None)
+    if isinstance(parsed, EntryAnalysis):
+        return parsed
+    text = response.text or ""
+    json_match = re.search(r"{[\s\S]*}", text)
+    return EntryAnalysis.model_validate_json(json_match.group(0) if json_match else text)
+
+
+def repair_entry_analysis(bad_output, error):
+    """Ask the model once to turn an invalid response into the required schema"""
+    repair_prompt = f"""
+    The following output was supposed to be JSON matching this schema, but it failed validation.
+
+    Schema: {json.dumps(EntryAnalysis.model_json_schema())}
+    Validation error: {error}
+    Output: {bad_output}
+
+    Return ONLY the corrected JSON object, keeping the original content.
+    """
+    response = generate_content_cached(
+        client,
+        contents=[repair_prompt],
+        config=ENTRY_ANALYSIS_CONFIG,
+        priority=PRIORITY_BATCH,
+        task="journal_analysis",
+    )
+    return parse_entry_analysis(response)
+
+
+def analyze_entry(entry):
+    """
+    Run the per-entry LLM analysis in one schema-constrained call returning
+    the psychological analysis, a short summary of it and emotion scores.
+    An invalid response gets one repair call; if that fails too the error is
+    raised, so the entry is reported as failed rather than silently scored 0.
+
+    Returns:
+        dict: {"analysis": str, "summary": str, "emotions": dict}
+    """
+    prompt = f"""
+    You are an expert psychologist analyzing journal entries.
+    Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
+
+    {format_entry_for_prompt(entry)}
+
+    Return a JSON object with:
+    {ENTRY_ANALYSIS_FIELDS}
+    """
+    response = generate_content_cached(
+        client,
+        contents=[prompt],
+        config=ENTRY_ANALYSIS_CONFIG,
+        priority=PRIORITY_BATCH,
+        task="journal_analysis",
+    )
     try:
-        # Firestore client
-        db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+        result = parse_entry_analysis(response)
+    except (ValidationError, ValueError) as e:
+        print(f"Invalid analysis for journal entry {entry['entry_id']}, repairing: {e}")
+        result = repair_entry_analysis(response.text, e)
+    return result.to_result()
+
+
+def analyze_entry_batch(entries):
+    """
+    Analyze several journal entries in one structured call.
+
+    Returns:
+        dict: entry_id -> result for the entries the response covered with a
+            valid result; entries missing from it are left to the caller
+    """
+    entry_ids = {entry["entry_id"] for entry in entries}
+    formatted = "\n\n    ".join(format_entry_for_prompt(entry) for entry in entries)
+    prompt = f"""
+    You are an expert psychologist analyzing journal entries.
+    Analyze each of the following journal entries separately as a psychologist. Focus on key insights and actionable takeaways:
 
+    {formatted}
+
+    Return a JSON object with a "results" array containing one object per entry, each with:
+    - "entry_id": the Entry ID exactly as given
+    {ENTRY_ANALYSIS_FIELDS}
+    """
+    response = generate_content_cached(
+        client,
+        contents=[prompt],
+        config=BATCH_ANALYSIS_CONFIG,
+        priority=PRIORITY_BATCH,
+        task="journal_batch_analysis",
+    )
+
+    parsed = getattr(response, "parsed", None)
+    if not isinstance(parsed, BatchAnalysis):
+        text = response.text or ""
+        json_match = re.search(r"{[\s\S]*}", text)
+        parsed = BatchAnalysis.model_validate_json(json_match.group(0) if json_match else text)
+
+    return {
+        item.entry_id: item.to_result()
+        for item in parsed.results
+        if item.entry_id in entry_ids
+    }
+
+
+def analyze_entries(authId, entries, cache_fields, user_data):
+    """
+    Analyze decrypted journal entries, reusing the cached analysis of entries
+    that have not changed since they were last analyzed (see journal_cache.py).
+    The remaining entries are analyzed concurrently with a per-call timeout
+    (see fanout.py), packed into multi-entry calls under a token budget when
+    JOURNAL_BATCH_MODE is on, and their results stored back on the entries.
+
+    Args:
+        authId (str): User authentication ID
+        entries (list): Decrypted entry dicts (entry_id, title, date, content)
+        cache_fields (dict): entry_id -> stored analysisCache field
+        user_data (dict): The user document (email and data keys)
+
+    Returns:
+        list: One dict per entry with the entry fields plus analysis, summary
+            and emotions, in the original order
+    """
+    user_email = user_data.get('email')
+    data_keys = user_data.get('dataKeys')
+    cached = load_cached_analyses(entries, cache_fields, user_email, data_keys)
+    print(f"Journal analysis cache: {len(cached)}/{len(entries)} entries reused")
+
+    def analyze_and_cache(entry):
+        result = analyze_entry(entry)
+        save_analysis(authId, entry, result, user_email, data_keys, user_data.get('dataKeyId'))
+        return result
+
+    def analysis_failed(entry, error):
+        # Not cached, so the entry is retried on the next report
+        print(f"Analysis failed for journal entry {entry['entry_id']}: {error}")
+        return {
+            "analysis": "Analysis unavailable for this entry.",
+            "summary": "",
+            "emotions": {e: 0 for e in EMOTIONS},
+        }
+
+    pending = [entry for entry in entries if entry["entry_id"] not in cached]
+
+    if JOURNAL_BATCH_MODE and len(pending) > 1:
+        # Short entries are packed into batched calls first; whatever a batch
+        # did not return (or a failed batch) falls back to single-entry calls
+        batches = [batch for batch in pack_entry_batches(pending) if len(batch) > 1]
+
+        def analyze_and_cache_batch(batch):
+            results = analyze_entry_batch(batch)
+            for entry in batch:
+                if entry["entry_id"] in results:
+                    save_analysis(authId, entry, results[entry["entry_id"]], user_email, data_keys, user_data.get('dataKeyId'))
+            return results
+
+        def batch_failed(batch, error):
+            print(f"Batched analysis of {len(batch)} journal entries failed, retrying one by one: {error}")
+            return {}
+
+        for results in run_map_bounded(analyze_and_cache_batch, batches, on_error=batch_failed):
+            cached.update(results)
+        remaining = [entry for entry in pending if entry["entry_id"] not in cached]
+        print(f"Journal analysis: {len(batches)} batched calls, {len(remaining)} entries left for single calls")
+        pending = remaining
+
+    # Remaining entries are analyzed concurrently (bounded by LLM_CONCURRENCY)
+    fresh = run_map_bounded(analyze_and_cache, pending, on_error=analysis_failed)
+    for entry, result in zip(pending, fresh):
+        cached[entry["entry_id"]] = result
+
+    analysis_results = []
+    for entry in entries:
+        result = cached[entry["entry_id"]]
+        analysis_results.append({
+            "entry_id": entry["entry_id"],
+            "date": entry["date"],
+            "title": entry["title"],
+            "content": entry["content"],
+            "analysis": result["analysis"],
+            "summary": result["summary"],
+            "emotions": result["emotions"],
+        })
+    return analysis_results
+
+
+# Your analysis pipeline
+def analyze_journal_entries(authId, journal_docs=None, user_data=None):
+    """
+    Analyze the user's latest journal entries.
+
+    Args:
+        authId (str): User authentication ID
+        journal_docs (list): Optional pre-fetched journal entry snapshots
+            (newest first). If omitted they are read from Firestore.
+        user_data (dict): Optional user document snapshot shared by the caller.
+            If omitted the document is read from Firestore.
+    """
+    try:
         # First, get the user's email for decryption
-        user_doc_ref = db.collection("users").document(authId)
-        user_doc = user_doc_ref.get()
-        
-        if not user_doc.exists:
-            print(f"User document not found for {authId}")
-            return {"entries": [], "analysis": "User not found."}
-        
-        user_data = user_doc.to_dict()
+        if user_data is None:
+            user_data = storage.get_user(authId)
+            
+            if user_data is None:
+                print(f"User document not found for {authId}")
+                return {"entries": [], "analysis": "User not found."}
+
         user_email = user_data.get('email')
+        data_keys = user_data.get('dataKeys')
         
         if not user_email:
             print(f"User email not found for {authId}")
             return {"entries": [], "analysis": "User email not found - required for decryption."}
 
-        # Fetch latest 10 journal entries for the user
-        journal_ref = db.collection("users").document(authId).collection("journalEntries")
-        
-        # Check if the collection exists by trying to get the first document
-        first_doc = next(journal_ref.limit(1).stream(), None)
-        if not first_doc:
+        if journal_docs is not None:
+            snapshot = journal_docs
+        else:
+            # Fetch latest journal entries for the user
+            snapshot = storage.get_journal_entries(authId, PERSONA_JOURNAL_LIMIT)
+
+        if not snapshot:
             print(f"No journal entries found for user {authId}")
             return {"entries": [], "analysis": "No journal entries available for analysis."}
-
-        # If collection exists, proceed with fetching entries
-        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(5)
-        snapshot = query.stream()
         
         # Process entries and handle encryption
         entries = []
-        for doc in snapshot:
-            entry_data = doc.to_dict()
-            
-            # Initialize variables for title and content
-            title = "Untitled"
-            content = ""
-            
-            # Handle encrypted or unencrypted title
-            if "encryptedTitle" in entry_data and entry_data["encryptedTitle"]:
-                try:
-                    title = decrypt(entry_data["encryptedTitle"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt title for entry {doc.id}: {e}")
-                    title = "[ENCRYPTED_TITLE_COULD_NOT_DECRYPT]"
-            elif "title" in entry_data:
-                title = entry_data.get("title", "Untitled")
-            
-            # Handle encrypted or unencrypted content
-            if "encryptedContent" in entry_data and entry_data["encryptedContent"]:
-                try:
-                    content = decrypt(entry_data["encryptedContent"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt content for entry {doc.id}: {e}")
-                    content = "[ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]"
-            elif "content" in entry_data:
-                content = entry_data.get("content", "")
-            
+        cache_fields = {}
+        for doc, entry_data, title, content in decrypt_journal_docs(snapshot, user_email, data_keys, "Untitled"):
             entries.append({
                 "entry_id": doc.id,
                 "title": title,
                 "content": content,
                 "date": entry_data.get("date", datetime.now())
             })
+            cache_fields[doc.id] = entry_data.get(ANALYSIS_CACHE_FIELD)
 
         if not entries:
             return {"entries": [], "analysis": "No journal entries available for analysis."}
 
-        # Convert entries to DataFrame for analysis
-        entries_df = pd.DataFrame(entries)
-        
-        # Rest of your existing analysis code...
-        analysis_results = []
-        for _, entry in entries_df.iterrows():
-            analysis_prompt = f"""
-            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
-
-            Title: {entry['title']}
-            Date: {entry['date']}
-            Content: {entry['content']}
-
-            Provide a concise yet comprehensive analysis covering:
-            1. Emotional state (primary and secondary emotions)
-            2. Cognitive patterns (positive/negative, rational/irrational)
-            3. Stress indicators and coping mechanisms
-            4. Notable behavioral patterns
-            5. Key concerns or growth opportunities
-            6. Specific recommendations for improvement
-
-            Format your response with clear bullet points for each category.
-            """
-            analysis_text = analyze_with_llm(analysis_prompt)
-
-            summary_prompt = f"""
-            Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
-            {analysis_text}
-
-            Focus on the most important takeaways that the journal writer should pay attention to.
-            Format as bullet points.
-            """
-            summary_text = analyze_with_llm(summary_prompt)
-
-            emotion_prompt = f"""
-            Analyze this journal entry and quantify the emotional content:
-            {entry['content']}
-
-            Return ONLY a JSON dictionary with values between 0-1 for these emotions: 
-            {EMOTIONS}
-            Example: {{"Joy": 0.5, "Sadness": 0.3, ...}}
-            """
-            try:
-                emotion_json = analyze_with_llm(
-                    emotion_prompt,
-                    system_prompt="You are an emotion analysis tool. Return ONLY valid JSON.",
-                )
-                emotion_data = json.loads(emotion_json.strip("`").replace("json\n", ""))
-            except:
-                emotion_data = {e: 0 for e in EMOTIONS}
-
-            analysis_results.append({
-                "entry_id": entry["entry_id"],
-                "date": entry["date"],
-                "title": entry["title"],
-                "content": entry["content"],
-                "analysis": analysis_text,
-                "summary": summary_text,
-                "emotions": emotion_data,
-            })
+        # Only new or edited entries are sent to the LLM
+        analysis_results = analyze_entries(authId, entries, cache_fields, user_data)
 
         analysis_df = pd.DataFrame(analysis_results)
         print("Analysis complete.")
@@ -886,9 +1124,10 @@ sns.set_palette("viridis")
 def analyze_with_llm_1(prompt, system_prompt="You are an expert psychologist analyzing journal entries."):
     full_prompt = f"{system_prompt}\n\n{prompt}"
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
+    response = generate_content_cached(
+        client,
         contents=[full_prompt],  # <-- must be a list of strings or Part instances
+        task="summary",
        
     )
 
@@ -1697,15 +1936,12 @@ def gen_mindlogpdf(authId, numdays, filename):
     print("--------------------------------")
     
     try:
-        # Step 1: Retrieve journal entries from Firestore
+        # Step 1: Retrieve journal entries from storage
         print("Step 1/4: Retrieving journal entries...")
-        # Use the already initialized db from your setup
-        
         # First, get the user's email for decryption
-        user_doc_ref = db.collection("users").document(authId)
-        user_doc = user_doc_ref.get()
+        user_data = storage.get_user(authId)
         
-        if not user_doc.exists:
+        if user_data is None:
             print(f"User document not found for {authId}")
             return {
                 "success": False,
@@ -1713,8 +1949,8 @@ def gen_mindlogpdf(authId, numdays, filename):
                 "error_code": "USER_NOT_FOUND"
             }
         
-        user_data = user_doc.to_dict()
         user_email = user_data.get('email')
+        data_keys = user_data.get('dataKeys')
         
         if not user_email:
             print(f"User email not found for {authId}")
@@ -1724,45 +1960,19 @@ def gen_mindlogpdf(authId, numdays, filename):
                 "error_code": "EMAIL_NOT_FOUND"
             }
         
-        journal_ref = db.collection("users").document(authId).collection("journalEntries")
-        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(numdays)
-        snapshot = query.stream()
+        snapshot = storage.get_journal_entries(authId, numdays)
 
         # Convert to DataFrame-compatible structure and handle encryption
         records = []
-        for doc in snapshot:
-            data = doc.to_dict()
-            
-            # Initialize variables for title and content
-            title = ""
-            content = ""
-            
-            # Handle encrypted or unencrypted title
-            if "encryptedTitle" in data and data["encryptedTitle"]:
-                try:
-                    title = decrypt(data["encryptedTitle"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt title for entry {doc.id}: {e}")
-                    title = "[ENCRYPTED_TITLE_COULD_NOT_DECRYPT]"
-            elif "title" in data:
-                title = data.get("title", "")
-            
-            # Handle encrypted or unencrypted content
-            if "encryptedContent" in data and data["encryptedContent"]:
-                try:
-                    content = decrypt(data["encryptedContent"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt content for entry {doc.id}: {e}")
-                    content = "[ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]"
-            elif "content" in data:
-                content = data.get("content", "")
-            
+        cache_fields = {}
+        for doc, data, title, content in decrypt_journal_docs(snapshot, user_email, data_keys, ""):
             records.append({
                 "entry_id": doc.id,
                 "title": title,
                 "date": data.get("date"),
                 "content": content
             })
+            cache_fields[doc.id] = data.get(ANALYSIS_CACHE_FIELD)
 
         # Check if we have enough entries
         if not records:
@@ -1784,71 +1994,9 @@ def gen_mindlogpdf(authId, numdays, filename):
         entries_df = pd.DataFrame(records)
         print(f"Retrieved {len(entries_df)} entries.")
 
-        # Step 2: Analyze entries with LLM
+        # Step 2: Analyze entries with LLM (only new or edited entries)
         print("Step 2/4: Analyzing entries...")
-        analysis_results = []
-        
-        for _, entry in entries_df.iterrows():
-            # Comprehensive psychological analysis
-            analysis_prompt = f"""
-            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
-
-            Title: {entry['title']}
-            Date: {entry['date']}
-            Content: {entry['content']}
-
-            Provide a concise yet comprehensive analysis covering:
-            1. Emotional state (primary and secondary emotions)
-            2. Cognitive patterns (positive/negative, rational/irrational)
-            3. Stress indicators and coping mechanisms
-            4. Notable behavioral patterns
-            5. Key concerns or growth opportunities
-            6. Specific recommendations for improvement
-
-            Format your response with clear bullet points for each category.
-            """
-            analysis_text = analyze_with_llm_1(analysis_prompt)
-
-            # Generate summary
-            summary_prompt = f"""
-            Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
-            {analysis_text}
-
-            Focus on the most important takeaways that the journal writer should pay attention to.
-            Format as bullet points.
-            """
-            summary_text = analyze_with_llm_1(summary_prompt)
-
-            # Emotion quantification
-            emotion_prompt = f"""
-            Analyze this journal entry and quantify the emotional content:
-            {entry['content']}
-
-            Return ONLY a JSON dictionary with values between 0-1 for these emotions: 
-            {EMOTIONS}
-            Example: {{"Joy": 0.5, "Sadness": 0.3, "Anger": 0.1, "Fear": 0.2, "Surprise": 0.0, "Disgust": 0.0, "Trust": 0.4, "Anticipation": 0.3}}
-            """
-            try:
-                emotion_json = analyze_with_llm_1(
-                    emotion_prompt,
-                    system_prompt="You are an emotion analysis tool. Return ONLY valid JSON.",
-                )
-                # Clean the JSON response
-                emotion_json_clean = emotion_json.strip().strip('`').replace('json\n', '').replace('json', '')
-                emotion_data = json.loads(emotion_json_clean)
-            except Exception as e:
-                print(f"Error parsing emotion data: {e}")
-                emotion_data = {e: 0 for e in EMOTIONS}
-
-            analysis_results.append({
-                "entry_id": entry["entry_id"],
-                "date": entry["date"],
-                "title": entry["title"],
-                "content": entry["content"],
-                "analysis": analysis_text,
-                "summary": summary_text,
-                "emotions": emotion_data,
-            })
+        analysis_results = analyze_entries(authId, records, cache_fields, user_data)
 
         analysis_df = pd.DataFrame(analysis_results)
         print("Analysis complete.")
@@ -1,81 +1,139 @@
 import asyncio
-from data import data_chat_extraction, analyze_journal_entries
+from data import data_chat_extraction, analyze_journal_entries, PERSONA_JOURNAL_LIMIT
 from conv import extract_information_gemini, generate_rag, extract_graph_info
 
-import firebase_admin
-from firebase_admin import credentials
-from google.cloud import firestore
+from repository import user_repository
+from unit_of_work import UserUnitOfWork
+from storage import history_length
+from datetime import datetime, timedelta, timezone
 import json
+import os
 
-# Initialize Firebase Admin
-cred = credentials.Certificate("service.json")
-
-def isPersonaUpdateNeeded(authId=None, updateRequired=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
-    if updateRequired is not None:
-        # If updated is provided, update the user's persona update status
-        user_ref = db.collection("users").document(authId)
-        user_ref.set({"updatePersona": updateRequired}, merge=True)
-        return updateRequired
-
-    user_ref = db.collection("users").document(authId)
-    user_doc = user_ref.get()
-    if user_doc.exists:
-        updateNeeded = user_doc.to_dict().get("updatePersona", True)
-        return updateNeeded
-    return True
-
-def personaInfo(authId=None, newInfo=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
-    user_ref = db.collection("users").document(authId)
-    persona_ref = user_ref.collection("persona")
-    doc_snapshots = persona_ref.get()
-    
-    if(newInfo is not None):
-        # If newInfo is provided, update or create the document
-        if doc_snapshots:
-            # Update the first document if it exists
-            first_doc = doc_snapshots[0]
-            first_doc.reference.set({"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP}, merge=True)
-        else:
-            # Create a new document with the provided info
-            persona_ref.add({"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP})
-
-    # If no newInfo is provided, just retrieve the existing info
-    # Initialize persona_info_value to None
-    # Retrieve the "Info" field from the first document in the collection
-
-    persona_info_value = None
-    if doc_snapshots: 
-        first_doc_data = doc_snapshots[0].to_dict()
-        if first_doc_data: # Check if to_dict() returned a dictionary (it should if doc exists)
-            persona_info_value = first_doc_data.get("Info") # Get the "Info" field
-    # print(f"Persona Info Value: {persona_info_value}")  # Debugging line to check the value
-    return persona_info_value
-    
-async def updatePersona(authId=None, user_message=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
-    # Step 1: Extract chat + journal data using authId
-    chat_data = data_chat_extraction(authId, "json")
-    journal_json = analyze_journal_entries(authId)
+# Incremental refreshes only see new messages and new or edited journal
+# entries; deleted entries and drift are corrected by a full rebuild at least
+# this often (0 disables the periodic rebuild)
+PERSONA_FULL_REFRESH_DAYS = float(os.getenv("PERSONA_FULL_REFRESH_DAYS", "7"))
+
+def load_previous_persona(persona):
+    """
+    Returns (info, graph, watermark) of a stored persona document, or
+    (None, None, None) if it cannot be used as a base for an incremental refresh
+    """
+    if not persona or not persona.get("Watermark") or not persona.get("Info"):
+        return None, None, None
+    watermark = persona["Watermark"]
+    # Watermarks written before journal entries were tracked by updatedAt
+    if "lastJournalUpdate" not in watermark:
+        return None, None, None
+    if full_refresh_due(watermark):
+        return None, None, None
+    try:
+        previous = json.loads(persona["Info"])
+    except (TypeError, ValueError):
+        return None, None, None
+    if not previous.get("Info") or not previous.get("Graph"):
+        return None, None, None
+    return previous["Info"], previous["Graph"], watermark
+
+def full_refresh_due(watermark, now=None):
+    """Whether the last full rebuild is older than PERSONA_FULL_REFRESH_DAYS"""
+    if PERSONA_FULL_REFRESH_DAYS <= 0:
+        return False
+    full_refresh_at = watermark.get("fullRefreshAt")
+    if full_refresh_at is None:
+        return True
+    now = now or datetime.now(timezone.utc)
+    return now - full_refresh_at > timedelta(days=PERSONA_FULL_REFRESH_DAYS)
+
+def journal_updated_at(entry_data):
+    """When a journal entry was last written (updatedAt, else createdAt)"""
+    return entry_data.get("updatedAt") or entry_data.get("createdAt")
+
+async def updatePersona(authId=None, user_message=None, uow=None, full_refresh=False):
+    # The request's unit of work supplies the user snapshot and collects the
+    # writes; one is created here when updatePersona is called on its own.
+    if uow is None:
+        uow = UserUnitOfWork(authId)
+    user_data = await uow.load()
+
+    # If the stored persona records how much history it covers, only the
+    # activity after that watermark (new messages, journal entries created or
+    # edited since) is sent to the LLM together with the previous persona;
+    # otherwise, or when a full rebuild is requested or due, the whole
+    # history is processed.
+    previous_info, previous_graph, watermark = (None, None, None)
+    if not full_refresh:
+        previous_info, previous_graph, watermark = load_previous_persona(await uow.get_persona())
+    incremental = watermark is not None
+
+    message_count = history_length(user_data)
+    start_index = watermark.get("lastMessageIndex", -1) + 1 if incremental else 0
+    journal_since = watermark.get("lastJournalUpdate") if incremental else None
+    # Taken before the reads: anything written later is picked up next time
+    refreshed_at = datetime.now(timezone.utc)
+
+    # Step 1: Extract chat + journal data using authId. Firestore reads are
+    # awaited and the blocking extraction work runs in worker threads.
+    # A full rebuild reads the latest entries; an incremental refresh reads
+    # every entry written since the watermark, however many there are, so
+    # none is skipped when the watermark moves past them
+    journal_limit = None if incremental else PERSONA_JOURNAL_LIMIT
+    journal_docs = await user_repository.get_journal_entries(
+        authId, journal_limit, updated_since=journal_since
+    )
+    has_new_messages = start_index < message_count
+    has_new_entries = len(journal_docs) > 0
+
+    if incremental and not has_new_messages and not has_new_entries:
+        # Nothing new since the last refresh: keep the persona, clear the flag
+        uow.update_user({"updatePersona": False})
+        await uow.commit()
+        return previous_info, previous_graph
+
+    # A source with nothing new is skipped (asyncio.sleep(0) resolves to None)
+    if has_new_messages or not incremental:
+        chat_task = asyncio.to_thread(data_chat_extraction, authId, "json", user_data, start_index)
+    else:
+        chat_task = asyncio.sleep(0)
+    if has_new_entries or not incremental:
+        journal_task = asyncio.to_thread(analyze_journal_entries, authId, journal_docs, user_data)
+    else:
+        journal_task = asyncio.sleep(0)
+    chat_data, journal_json = await asyncio.gather(chat_task, journal_task)
 
     # Step 2: Generate combined RAG result
-    rag_result = generate_rag(chat_data=chat_data, journal_analysis=journal_json)
+    previous_profile = {"Info": previous_info, "Graph": previous_graph} if incremental else None
+    rag_result = await generate_rag(
+        chat_data=chat_data, journal_analysis=journal_json, previous_profile=previous_profile
+    )
 
     # Step 3: Extract info + graph in parallel
-    info_task = asyncio.to_thread(extract_information_gemini, rag_result)
-    graph_task = asyncio.to_thread(extract_graph_info, rag_result)
+    info_task = extract_information_gemini(rag_result, previous_info)
+    graph_task = extract_graph_info(rag_result, previous_graph)
     info_json, graph_json = await asyncio.gather(info_task, graph_task)
 
-    # Step 4: Store the extracted info and graph in Firestore
+    # Step 4: Store the extracted info and graph in Firestore, with the
+    # watermark of the history they cover. The journal watermark is the
+    # entries' own updatedAt, so backdated and edited entries are picked up.
+    if incremental:
+        journal_updates = [journal_since] + [journal_updated_at(doc.to_dict()) for doc in journal_docs]
+        last_journal_update = max((updated for updated in journal_updates if updated), default=refreshed_at)
+        full_refresh_at = watermark.get("fullRefreshAt")
+    else:
+        last_journal_update = full_refresh_at = refreshed_at
+    new_watermark = {
+        "lastMessageIndex": message_count - 1,
+        "lastJournalUpdate": last_journal_update,
+        "fullRefreshAt": full_refresh_at,
+    }
     temp = {"Info": info_json, "Graph": graph_json}
     temp_string = json.dumps(temp)
-    personaInfo(authId, newInfo=temp_string)
+    uow.set_persona_info(temp_string, watermark=new_watermark)
 
     # Step 5: update the user's persona update status
-    isPersonaUpdateNeeded(authId,updateRequired=False) 
+    uow.update_user({"updatePersona": False})
+
+    # Commit both writes in one batch
+    await uow.commit()
 
     return info_json, graph_json
\ No newline at end of file
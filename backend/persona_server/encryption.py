@@ -5,10 +5,45 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 import secrets
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cache import TTLCache
 
 # Get master key from environment variable
 MASTER_KEY = os.getenv('NEXT_PUBLIC_ENCRYPTION_KEY')
 
+# Derived-key cache settings (entries are kept in memory only)
+KEY_CACHE_SIZE = int(os.getenv('ENCRYPTION_KEY_CACHE_SIZE', '4096'))
+KEY_CACHE_TTL = float(os.getenv('ENCRYPTION_KEY_CACHE_TTL', '900'))
+
+# v2 envelope: "v2:<key_id>:<base64(nonce + ciphertext)>". ':' is not part of
+# the base64 alphabet, so v1 blobs (base64(salt + nonce + ciphertext)) can
+# never be mistaken for v2 ones.
+V2_PREFIX = 'v2:'
+
+# Batch decryption pool: "thread" or "process", and how many workers to use.
+# Batches smaller than DECRYPT_PARALLEL_MIN are decrypted on the calling thread.
+DECRYPT_POOL = os.getenv('DECRYPT_POOL', 'thread')
+DECRYPT_WORKERS = int(os.getenv('DECRYPT_WORKERS', str(os.cpu_count() or 4)))
+DECRYPT_PARALLEL_MIN = int(os.getenv('DECRYPT_PARALLEL_MIN', '8'))
+
+# Placeholder stored in place of a history message that cannot be decrypted
+HISTORY_DECRYPT_PLACEHOLDER = "[ENCRYPTED_DATA_COULD_NOT_DECRYPT]"
+
+def key_cache_key(password: str, salt: bytes) -> bytes:
+    """
+    Cache key of a derived key: a SHA-256 digest of the key material plus the
+    salt, so the plaintext password is never stored in the cache
+    """
+    return hashlib.sha256(password.encode('utf-8')).digest() + salt
+
+# PBKDF2-derived keys, keyed by key_cache_key(password, salt)
+key_cache = TTLCache(max_size=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL)
+# Unwrapped per-user data keys, keyed by key_cache_key(key material, wrapped key)
+data_key_cache = TTLCache(max_size=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL)
+
 def derive_key(password: str, salt: bytes) -> bytes:
     """
     Derives a crypto key from a password using PBKDF2
@@ -29,16 +64,92 @@ def derive_key(password: str, salt: bytes) -> bytes:
     )
     return kdf.derive(password.encode('utf-8'))
 
-def encrypt(data: str, encryption_key: str) -> str:
+def get_derived_key(password: str, salt: bytes) -> bytes:
+    """
+    Returns the PBKDF2 key for (password, salt), using the in-memory cache
+    
+    Args:
+        password: The password string
+        salt: Salt bytes stored alongside the ciphertext
+        
+    Returns:
+        bytes: 32-byte derived key
+    """
+    key = key_cache.get(key_cache_key(password, salt))
+    if key is None:
+        key = derive_key(password, salt)
+        key_cache.put(key_cache_key(password, salt), key)
+    return key
+
+def create_data_key(encryption_key: str) -> tuple:
+    """
+    Generates a random per-user data key and wraps it with the user's key
+    
+    Args:
+        encryption_key: The password/key the data key is wrapped with
+        
+    Returns:
+        tuple: (key_id, wrapped_key) to store in the user's `dataKeys` map
+    """
+    if not encryption_key:
+        raise ValueError('Encryption key is required')
+
+    key_id = secrets.token_hex(8)
+    data_key = AESGCM.generate_key(bit_length=256)
+
+    salt = secrets.token_bytes(16)
+    nonce = secrets.token_bytes(12)
+    wrapping_key = derive_key(encryption_key, salt)
+    wrapped = AESGCM(wrapping_key).encrypt(nonce, data_key, key_id.encode('utf-8'))
+
+    wrapped_key = base64.b64encode(salt + nonce + wrapped).decode('utf-8')
+    data_key_cache.put(key_cache_key(encryption_key, wrapped_key.encode('utf-8')), data_key)
+    return key_id, wrapped_key
+
+def unwrap_data_key(key_id: str, wrapped_key: str, encryption_key: str) -> bytes:
+    """
+    Unwraps a per-user data key (one PBKDF2 per key, then cached)
+    
+    Args:
+        key_id: Id of the data key, bound to the wrapped key as associated data
+        wrapped_key: Base64 encoded salt + nonce + wrapped key
+        encryption_key: The password/key the data key was wrapped with
+        
+    Returns:
+        bytes: 32-byte data key
+    """
+    cache_salt = wrapped_key.encode('utf-8')
+    data_key = data_key_cache.get(key_cache_key(encryption_key, cache_salt))
+    if data_key is None:
+        combined = base64.b64decode(cache_salt)
+        salt = combined[:16]
+        nonce = combined[16:28]
+        wrapped = combined[28:]
+        wrapping_key = get_derived_key(encryption_key, salt)
+        data_key = AESGCM(wrapping_key).decrypt(nonce, wrapped, key_id.encode('utf-8'))
+        data_key_cache.put(key_cache_key(encryption_key, cache_salt), data_key)
+    return data_key
+
+def is_v2(encrypted_data: str) -> bool:
+    """
+    Returns True if the value uses the v2 (per-user data key) envelope
+    """
+    return isinstance(encrypted_data, str) and encrypted_data.startswith(V2_PREFIX)
+
+def encrypt(data: str, encryption_key: str, data_keys: dict = None, key_id: str = None) -> str:
     """
     Encrypts data using AES-GCM
     
     Args:
         data: The string data to encrypt
         encryption_key: The password/key to use for encryption
+        data_keys: Optional map of key_id -> wrapped data key (the user's
+            `dataKeys` field)
+        key_id: If given, encrypt with that data key using the v2 envelope
         
     Returns:
-        str: Base64 encoded encrypted data with salt and nonce
+        str: Base64 encoded encrypted data with salt and nonce (v1), or a
+            v2 envelope carrying only the key id and nonce
         
     Raises:
         ValueError: If data or encryption_key is empty
@@ -46,6 +157,14 @@ def encrypt(data: str, encryption_key: str) -> str:
     if not data or not encryption_key:
         raise ValueError('Data and encryption key are required')
     
+    if key_id is not None:
+        if not data_keys or key_id not in data_keys:
+            raise ValueError(f'Unknown data key: {key_id}')
+        data_key = unwrap_data_key(key_id, data_keys[key_id], encryption_key)
+        nonce = secrets.token_bytes(12)
+        encrypted = AESGCM(data_key).encrypt(nonce, data.encode('utf-8'), key_id.encode('utf-8'))
+        return V2_PREFIX + key_id + ':' + base64.b64encode(nonce + encrypted).decode('utf-8')
+
     # Generate random salt and nonce
     salt = secrets.token_bytes(16)  # 16 bytes salt
     nonce = secrets.token_bytes(12)  # 12 bytes nonce for AES-GCM
@@ -63,13 +182,14 @@ def encrypt(data: str, encryption_key: str) -> str:
     # Convert to base64 for easy storage/transmission
     return base64.b64encode(combined).decode('utf-8')
 
-def decrypt(encrypted_data: str, encryption_key: str) -> str:
+def decrypt(encrypted_data: str, encryption_key: str, data_keys: dict = None) -> str:
     """
-    Decrypts data using AES-GCM
+    Decrypts data using AES-GCM, auto-detecting the v1 and v2 formats
     
     Args:
-        encrypted_data: Base64 encoded encrypted data
+        encrypted_data: Base64 encoded encrypted data or a v2 envelope
         encryption_key: The password/key used for encryption
+        data_keys: Map of key_id -> wrapped data key, required for v2 values
         
     Returns:
         str: The decrypted string
@@ -82,6 +202,15 @@ def decrypt(encrypted_data: str, encryption_key: str) -> str:
         raise ValueError('Encrypted data and encryption key are required')
     
     try:
+        if is_v2(encrypted_data):
+            _, key_id, payload = encrypted_data.split(':', 2)
+            if not data_keys or key_id not in data_keys:
+                raise ValueError(f'data key {key_id} not available')
+            data_key = unwrap_data_key(key_id, data_keys[key_id], encryption_key)
+            combined = base64.b64decode(payload.encode('utf-8'))
+            decrypted = AESGCM(data_key).decrypt(combined[:12], combined[12:], key_id.encode('utf-8'))
+            return decrypted.decode('utf-8')
+
         # Convert from base64
         combined = base64.b64decode(encrypted_data.encode('utf-8'))
         
@@ -90,8 +219,8 @@ def decrypt(encrypted_data: str, encryption_key: str) -> str:
         nonce = combined[16:28]
         encrypted = combined[28:]
         
-        # Derive key from password
-        key = derive_key(encryption_key, salt)
+        # Derive key from password (cached per salt)
+        key = get_derived_key(encryption_key, salt)
         
         # Create AESGCM instance and decrypt
         aesgcm = AESGCM(key)
@@ -102,5 +231,124 @@ def decrypt(encrypted_data: str, encryption_key: str) -> str:
     except Exception as error:
         raise Exception(f'Decryption failed: Invalid data or wrong key - {str(error)}')
 
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """
+    Returns the shared decryption pool, creating it on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if DECRYPT_POOL == 'process':
+                _executor = ProcessPoolExecutor(max_workers=DECRYPT_WORKERS)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=DECRYPT_WORKERS, thread_name_prefix='decrypt')
+        return _executor
+
+def shutdown_decrypt_pool() -> None:
+    """
+    Shuts down the shared decryption pool (it is recreated on next use)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+def _decrypt_item(args) -> tuple:
+    # Module-level so it can be pickled for the process pool
+    encrypted_data, encryption_key, data_keys = args
+    try:
+        return True, decrypt(encrypted_data, encryption_key, data_keys)
+    except Exception as error:
+        return False, str(error)
+
+def decrypt_many(encrypted_items: list, encryption_key: str, fallback=None, data_keys: dict = None) -> list:
+    """
+    Decrypts a batch of values encrypted with the same key
+    
+    Large batches are fanned out over the shared thread or process pool
+    (see DECRYPT_POOL / DECRYPT_WORKERS); results keep the input order.
+    
+    Args:
+        encrypted_items: List of base64 encoded encrypted values
+        encryption_key: The password/key used for encryption
+        fallback: Value to use for items that fail to decrypt, either a
+            single value or a list with one fallback per item. If None,
+            the first failure is raised.
+        data_keys: Map of key_id -> wrapped data key, required for v2 values
+        
+    Returns:
+        list: Decrypted strings in the same order as encrypted_items
+    """
+    work = [(encrypted_data, encryption_key, data_keys) for encrypted_data in encrypted_items]
+
+    if len(work) >= DECRYPT_PARALLEL_MIN and DECRYPT_WORKERS > 1:
+        chunksize = max(1, len(work) // (DECRYPT_WORKERS * 4))
+        outcomes = list(_get_executor().map(_decrypt_item, work, chunksize=chunksize))
+    else:
+        outcomes = [_decrypt_item(item) for item in work]
+
+    results = []
+    for index, (ok, value) in enumerate(outcomes):
+        if ok:
+            results.append(value)
+            continue
+        if fallback is None:
+            raise Exception(value)
+        print(f"Failed to decrypt item {index}: {value}")
+        results.append(fallback[index] if isinstance(fallback, list) else fallback)
+    return results
+
+def decrypt_history(user_history: list, encryption_key: str, data_keys: dict = None) -> list:
+    """
+    Decrypts the `encryptedMessage` of every userHistory entry in one batch
+    
+    Each decrypted entry gets a `message` field in place of `encryptedMessage`;
+    other fields and non-dict entries are copied as-is. Messages that cannot
+    be decrypted are replaced with HISTORY_DECRYPT_PLACEHOLDER.
+    
+    Args:
+        user_history: The user's userHistory list
+        encryption_key: The password/key used for encryption
+        data_keys: Map of key_id -> wrapped data key, required for v2 values
+        
+    Returns:
+        list: Decrypted history in the original order
+    """
+    positions = [
+        index for index, entry in enumerate(user_history)
+        if isinstance(entry, dict) and entry.get('encryptedMessage')
+    ]
+    messages = decrypt_many(
+        [user_history[index]['encryptedMessage'] for index in positions],
+        encryption_key,
+        fallback=HISTORY_DECRYPT_PLACEHOLDER,
+        data_keys=data_keys,
+    )
+    decrypted_messages = dict(zip(positions, messages))
+
+    decrypted_user_history = []
+    for index, entry in enumerate(user_history):
+        if index not in decrypted_messages:
+            decrypted_user_history.append(entry)
+            continue
+        decrypted_entry = {}
+        for key, value in entry.items():
+            if key == 'encryptedMessage':
+                decrypted_entry['message'] = decrypted_messages[index]
+            else:
+                decrypted_entry[key] = value
+        decrypted_user_history.append(decrypted_entry)
+    return decrypted_user_history
+
+def key_cache_stats() -> dict:
+    """
+    Returns hit/miss counters and size of the derived-key cache
+    """
+    return key_cache.stats()
+
 # Export the functions and master key
-__all__ = ['encrypt', 'decrypt', 'MASTER_KEY']
\ No newline at end of file
+__all__ = ['encrypt', 'decrypt', 'decrypt_many', 'decrypt_history', 'create_data_key', 'is_v2', 'key_cache_stats', 'MASTER_KEY']
\ No newline at end of file
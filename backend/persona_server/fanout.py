@@ -0,0 +1,84 @@
+"""
+Bounded-concurrency fan-out of blocking calls (LLM requests) over a thread
+pool, with a per-item timeout and results kept in input order.
+
+Every fan-out gets its own pool of `concurrency` workers, so concurrent
+fan-outs (e.g. two reports generated at once) never queue behind each
+other, and an item's timeout only counts the time it actually runs. The
+process-wide limit on concurrent LLM calls is the gateway's
+LLM_MAX_CONCURRENCY (see llm_gateway), which also bounds every call with a
+deadline.
+
+A dedicated pool is used instead of asyncio.to_thread so the concurrency is
+not capped by the default executor (min(32, cpu_count + 4) threads) and slow
+LLM calls do not starve the FastAPI handlers that also use it.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrent LLM calls per fan-out and the deadline for one item
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_ITEM_TIMEOUT = float(os.getenv("LLM_ITEM_TIMEOUT", "120"))
+
+
+async def map_bounded(fn, items, concurrency=LLM_CONCURRENCY, timeout=LLM_ITEM_TIMEOUT, on_error=None):
+    """
+    Run fn(item) for every item with at most `concurrency` calls in flight.
+
+    Args:
+        fn: Blocking function called with one item
+        items (list): Inputs
+        concurrency (int): Maximum concurrent calls of this fan-out
+        timeout (float): Seconds allowed per item once it is running (None
+            for no limit)
+        on_error: Called as on_error(item, exception) when an item fails or
+            times out; its return value takes the item's place. If None the
+            exception is raised.
+
+    Returns:
+        list: Results in the order of `items`
+    """
+    loop = asyncio.get_running_loop()
+    limit = max(1, concurrency)
+    semaphore = asyncio.Semaphore(limit)
+    executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix="llm-fanout")
+
+    def release(_):
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            pass  # The fan-out already returned and its loop is closed
+
+    async def run(item):
+        await semaphore.acquire()
+        # The slot is held until the thread finishes, even after a timeout,
+        # so every submitted item starts on a free worker right away
+        future = executor.submit(fn, item)
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except Exception as e:
+            if on_error is None:
+                raise
+            if isinstance(e, asyncio.TimeoutError):
+                e = TimeoutError(f"timed out after {timeout}s")
+            return on_error(item, e)
+
+    try:
+        return await asyncio.gather(*(run(item) for item in items))
+    finally:
+        # Timed-out calls finish in the background; they are bounded by the
+        # gateway deadline
+        executor.shutdown(wait=False)
+
+
+def run_map_bounded(fn, items, concurrency=LLM_CONCURRENCY, timeout=LLM_ITEM_TIMEOUT, on_error=None):
+    """
+    Synchronous entry point to map_bounded for code running in worker
+    threads (e.g. functions called through asyncio.to_thread).
+    """
+    items = list(items)
+    if not items:
+        return []
+    return asyncio.run(map_bounded(fn, items, concurrency, timeout, on_error))
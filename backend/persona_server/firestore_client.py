@@ -0,0 +1,135 @@
+import inspect
+import itertools
+import os
+import threading
+
+import firebase_admin
+from firebase_admin import credentials
+from google.cloud import firestore
+from google.cloud.client import Client as CloudClient
+
+# Number of Firestore clients to keep open. Each client owns its own gRPC
+# channel, so more than one spreads concurrent requests over several
+# connections instead of multiplexing them all on a single HTTP/2 channel.
+FIRESTORE_POOL_SIZE = int(os.getenv("FIRESTORE_POOL_SIZE", "1"))
+
+_cred = None
+_cred_lock = threading.Lock()
+
+
+def get_credentials():
+    """
+    Load service.json and initialize Firebase Admin on first use, so servers
+    running on another storage backend do not need the credentials file
+    """
+    global _cred
+    with _cred_lock:
+        if _cred is None:
+            _cred = credentials.Certificate("service.json")
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(_cred)
+        return _cred
+
+
+def _close_channel(client):
+    """
+    Close a client and its gRPC channel; returns an awaitable for async clients.
+
+    The Firestore clients inherit google.cloud.client.Client.close, which
+    only closes the HTTP session, so the channel is closed through the
+    transport when the client does not override close() itself (and only if
+    this library version still exposes it).
+    """
+    result = client.close()
+    if type(client).close is not CloudClient.close:
+        return result
+    api = getattr(client, "_firestore_api_internal", None)
+    transport = getattr(api, "transport", None)
+    if transport is None or not hasattr(transport, "close"):
+        return None
+    return transport.close()
+
+
+class FirestorePool:
+    """
+    Process-wide pool of Firestore clients.
+
+    Clients are created once (at FastAPI startup, or lazily on first use for
+    scripts) and handed out round-robin, so credentials are parsed and the
+    gRPC channel / TLS handshake happen once per client instead of per call.
+    The pool also owns one AsyncClient for code running on the event loop.
+    """
+
+    def __init__(self, size=FIRESTORE_POOL_SIZE):
+        self.size = max(1, size)
+        self._clients = []
+        self._cycle = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _start_locked(self):
+        if not self._clients:
+            cred = get_credentials()
+            self._clients = [
+                firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+                for _ in range(self.size)
+            ]
+            self._cycle = itertools.cycle(self._clients)
+
+    def start(self):
+        """Create the pooled clients if they do not exist yet"""
+        with self._lock:
+            self._start_locked()
+
+    def get(self):
+        """Return the next client from the pool, (re)creating the pool if needed"""
+        with self._lock:
+            self._start_locked()
+            return next(self._cycle)
+
+    def get_async(self):
+        """Return the shared AsyncClient (must be called from the event loop)"""
+        with self._lock:
+            if self._async_client is None:
+                cred = get_credentials()
+                self._async_client = firestore.AsyncClient(
+                    credentials=cred.get_credential(), project=cred.project_id
+                )
+            return self._async_client
+
+    def close(self):
+        """Close every pooled sync client and its channel"""
+        with self._lock:
+            clients, self._clients, self._cycle = self._clients, [], None
+        for client in clients:
+            try:
+                _close_channel(client)
+            except Exception as e:
+                print(f"Error closing Firestore client: {e}")
+
+    async def aclose(self):
+        """Close the AsyncClient and then the sync clients"""
+        with self._lock:
+            async_client, self._async_client = self._async_client, None
+        if async_client is not None:
+            try:
+                result = _close_channel(async_client)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error closing async Firestore client: {e}")
+        self.close()
+
+
+# Create a global instance of the Firestore pool
+firestore_pool = FirestorePool()
+
+
+def get_db():
+    """Shared Firestore client for the current process"""
+    return firestore_pool.get()
+
+
+def get_async_db():
+    """Shared Firestore AsyncClient for the current process"""
+    return firestore_pool.get_async()
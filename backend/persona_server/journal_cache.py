@@ -0,0 +1,72 @@
+"""
+Per-entry cache of the LLM journal analysis (analysis, summary, emotions).
+
+The result is stored encrypted on the journal entry itself, in the
+`analysisCache` field, together with the key it was computed for:
+
+    {"key": "<prompt version>:<sha256 of entry id, title, date, content>",
+     "encryptedResult": "<encrypted JSON>"}
+
+An entry whose title, date or content changed, or whose cache was written by
+an older prompt version, no longer matches its key and is analyzed again.
+Bump ANALYSIS_PROMPT_VERSION whenever the analysis prompts change.
+"""
+import hashlib
+import json
+
+from encryption import decrypt_many, encrypt
+from repository import storage
+
+ANALYSIS_PROMPT_VERSION = "2"
+ANALYSIS_CACHE_FIELD = "analysisCache"
+
+
+def analysis_cache_key(entry):
+    """Cache key of a decrypted entry dict (entry_id, title, date, content)"""
+    fingerprint = json.dumps(
+        [entry["entry_id"], entry["title"], str(entry["date"]), entry["content"]],
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+    return f"{ANALYSIS_PROMPT_VERSION}:{digest}"
+
+
+def load_cached_analyses(entries, cache_fields, user_email, data_keys=None):
+    """
+    Return {entry_id: result} for the entries whose stored analysis is still valid.
+
+    Args:
+        entries (list): Decrypted entry dicts
+        cache_fields (dict): entry_id -> stored analysisCache field (or None)
+        user_email (str): The user's encryption key
+        data_keys (dict): The user's wrapped data keys, for v2 values
+    """
+    valid = []
+    for entry in entries:
+        cached = cache_fields.get(entry["entry_id"])
+        if cached and cached.get("key") == analysis_cache_key(entry) and cached.get("encryptedResult"):
+            valid.append((entry["entry_id"], cached["encryptedResult"]))
+
+    results = {}
+    decrypted = decrypt_many(
+        [value for _, value in valid], user_email, fallback=[None] * len(valid), data_keys=data_keys
+    )
+    for (entry_id, _), plaintext in zip(valid, decrypted):
+        if plaintext is None:
+            continue
+        try:
+            results[entry_id] = json.loads(plaintext)
+        except json.JSONDecodeError:
+            pass
+    return results
+
+
+def save_analysis(authId, entry, result, user_email, data_keys=None, key_id=None):
+    """Encrypt an analysis result and store it on its journal entry"""
+    try:
+        encrypted = encrypt(json.dumps(result, ensure_ascii=False), user_email, data_keys, key_id)
+        storage.update_journal_entry(authId, entry["entry_id"], {
+            ANALYSIS_CACHE_FIELD: {"key": analysis_cache_key(entry), "encryptedResult": encrypted},
+        })
+    except Exception as e:
+        print(f"Error caching analysis for journal entry {entry['entry_id']}: {e}")
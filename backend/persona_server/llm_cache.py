@@ -0,0 +1,388 @@
+"""
+Content-addressed cache of LLM responses, persisted to a local SQLite file
+and encrypted at rest.
+
+A response is keyed by the sha256 of (model, normalized prompt, generation
+config), so the same extraction prompt over the same data is answered from
+the cache instead of calling Gemini again, also across restarts. Prompts are
+normalized by stripping surrounding whitespace from every line, so indentation
+changes in the prompt templates do not invalidate the cache; bump
+LLM_CACHE_VERSION to drop every stored response after a prompt's meaning
+changes.
+
+Responses contain decrypted user data, so they are only written to disk
+AES-GCM encrypted with a key derived from LLM_CACHE_KEY, with the cache key
+as associated data. LLM_CACHE_KEY must be a server-only secret: the
+NEXT_PUBLIC_ENCRYPTION_KEY is shipped to browsers and is deliberately not
+used. Without LLM_CACHE_KEY the cache stays in memory only.
+
+Only use it for deterministic calls (extraction, analysis, summaries), never
+for chat replies or anything that should vary between calls.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from cache import TTLCache
+from encryption import derive_key
+from llm_gateway import PRIORITY_DEFAULT, agenerate_content, generate_content
+from llm_hedging import hedge_policy
+from llm_routing import task_router
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_KEY = os.getenv("LLM_CACHE_KEY")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "512"))
+LLM_CACHE_VERSION = "1"
+
+# Fixed salt: the derived key only has to be stable for this cache file
+_KEY_SALT = b"soulscript-llm-response-cache"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_responses_accessed ON llm_responses (accessed_at);
+CREATE INDEX IF NOT EXISTS llm_responses_expires ON llm_responses (expires_at);
+"""
+
+
+def _normalize_contents(contents):
+    if contents is None or isinstance(contents, (bool, int, float)):
+        return contents
+    if isinstance(contents, str):
+        return "\n".join(line.strip() for line in contents.strip().splitlines())
+    if isinstance(contents, (list, tuple)):
+        return [_normalize_contents(item) for item in contents]
+    if isinstance(contents, dict):
+        return {key: _normalize_contents(value) for key, value in contents.items()}
+    if hasattr(contents, "model_dump"):
+        return _normalize_contents(contents.model_dump(mode="json", exclude_none=True))
+    return str(contents)
+
+
+def _schema_class(config):
+    schema = getattr(config, "response_schema", None)
+    return schema if isinstance(schema, type) and hasattr(schema, "model_validate_json") else None
+
+
+def _normalize_config(config):
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        data = {key: value for key, value in config.items() if key not in ("http_options", "response_schema")}
+        schema = config.get("response_schema")
+    else:
+        data = config.model_dump(mode="json", exclude_none=True, exclude={"http_options", "response_schema"})
+        schema = getattr(config, "response_schema", None)
+    if schema is not None:
+        data["response_schema"] = schema.model_json_schema() if hasattr(schema, "model_json_schema") else str(schema)
+    return data
+
+
+def response_cache_key(model, contents, config=None):
+    """sha256 of the model, the normalized prompt and the generation config"""
+    fingerprint = json.dumps(
+        [LLM_CACHE_VERSION, model, _normalize_contents(contents), _normalize_config(config)],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """The parts of a GenerateContentResponse the call sites read"""
+
+    def __init__(self, text, parsed=None):
+        self.text = text
+        self.parsed = parsed
+
+
+class LLMResponseCache:
+    """
+    In-memory LRU in front of an encrypted SQLite file. Entries expire after
+    `ttl` seconds; the file is trimmed to `max_entries` and `max_bytes` by
+    evicting the least recently used responses.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, secret=LLM_CACHE_KEY, ttl=LLM_CACHE_TTL,
+                 max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES,
+                 memory_size=LLM_CACHE_MEMORY_SIZE, enabled=LLM_CACHE_ENABLED):
+        self.enabled = enabled
+        self.path = path if secret else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = TTLCache(max_size=memory_size, ttl=ttl)
+        self.disk_hits = 0
+        self.writes = 0
+        self.disk_evictions = 0
+        self._secret = secret
+        self._aead = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._aead = AESGCM(derive_key(self._secret, _KEY_SALT))
+        return self._conn
+
+    def _disk_get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM llm_responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE llm_responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            blob = row[0]
+            try:
+                return self._aead.decrypt(blob[:12], blob[12:], key.encode("utf-8")).decode("utf-8")
+            except Exception:
+                # Written with another key: drop it and call the model again
+                conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                conn.commit()
+                return None
+
+    def _disk_put(self, key, text):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            nonce = secrets.token_bytes(12)
+            blob = nonce + self._aead.encrypt(nonce, text.encode("utf-8"), key.encode("utf-8"))
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, size, created_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now + self.ttl, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        removed = conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,)).rowcount
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+        if count > self.max_entries or size > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM llm_responses ORDER BY accessed_at").fetchall()
+            stale = []
+            for key, entry_size in rows:
+                if count <= self.max_entries and size <= self.max_bytes:
+                    break
+                stale.append((key,))
+                count -= 1
+                size -= entry_size
+            conn.executemany("DELETE FROM llm_responses WHERE key = ?", stale)
+            removed += len(stale)
+        self.disk_evictions += removed
+
+    def get(self, key):
+        """Cached response text for a key, or None"""
+        if not self.enabled:
+            return None
+        text = self.memory.get(key)
+        if text is not None or self.path is None:
+            return text
+        try:
+            text = self._disk_get(key)
+        except Exception as e:
+            print(f"Error reading LLM cache: {e}")
+            return None
+        if text is not None:
+            self.disk_hits += 1
+            self.memory.put(key, text)
+        return text
+
+    def put(self, key, text):
+        """Store a response text under a key"""
+        if not self.enabled or not text:
+            return
+        self.memory.put(key, text)
+        self.writes += 1
+        if self.path is None:
+            return
+        try:
+            self._disk_put(key, text)
+        except Exception as e:
+            print(f"Error writing LLM cache: {e}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.path is None:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_responses")
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        stats = {
+            "enabled": self.enabled,
+            "persistent": self.path is not None,
+            "memory": self.memory.stats(),
+            "disk_hits": self.disk_hits,
+            "writes": self.writes,
+            "disk_evictions": self.disk_evictions,
+        }
+        if self.enabled and self.path is not None and self._conn is not None:
+            with self._lock:
+                count, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses"
+                ).fetchone()
+            stats.update({"disk_entries": count, "disk_bytes": size})
+        return stats
+
+
+def _cached_response(text, config):
+    schema = _schema_class(config)
+    parsed = None
+    if schema is not None:
+        try:
+            parsed = schema.model_validate_json(text)
+        except Exception:
+            parsed = None
+    return CachedResponse(text, parsed)
+
+
+def _finished_normally(response):
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return False
+    reason = getattr(candidates[0], "finish_reason", None)
+    name = getattr(reason, "name", None) or str(reason or "")
+    return name.rsplit(".", 1)[-1] == "STOP"
+
+
+def is_cacheable(response, config=None, cacheable=None):
+    """
+    Whether a live response may be cached: it has text, finished with STOP
+    (not MAX_TOKENS, SAFETY, ...), validates against config.response_schema
+    when one is set, and passes the caller's `cacheable` check if given.
+    A truncated or invalid response is never pinned, so a retry calls the
+    model again.
+    """
+    text = getattr(response, "text", None)
+    if not text or not _finished_normally(response):
+        return False
+    schema = _schema_class(config)
+    if schema is not None:
+        try:
+            schema.model_validate_json(text)
+        except Exception:
+            return False
+    return cacheable is None or bool(cacheable(response))
+
+
+def parses_as_json(response):
+    """`cacheable` check for prompts that must return JSON (code fences allowed)"""
+    text = (response.text or "").replace("```json", "").replace("```", "").strip()
+    try:
+        json.loads(text)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def generate_content_cached(client, model=None, contents=None, config=None, priority=PRIORITY_DEFAULT,
+                            deadline=None, task=None, cacheable=None):
+    """
+    client.models.generate_content through the response cache; misses are
+    sent through the LLM gateway, hedged if enabled for the task.
+
+    Args:
+        client: A google-genai client
+        model (str): Model name; defaults to the task's routed model
+        contents: The prompt, as passed to generate_content
+        config: Optional GenerateContentConfig, merged with the task's
+            output cap and temperature
+        priority (int): Gateway priority of a cache miss
+        deadline (float): Gateway deadline of a cache miss, in seconds;
+            defaults to the task's timeout
+        task (str): Task name, for routing, hedging and metrics
+        cacheable: Optional predicate on the response; only responses it
+            accepts (on top of is_cacheable's checks) are cached
+
+    Returns:
+        The model's response, or a CachedResponse with `.text` and `.parsed`
+        (re-validated against config.response_schema) on a cache hit
+    """
+    model = task_router.model(task, model)
+    config = task_router.config(task, config)
+    deadline = task_router.deadline(task, deadline)
+    key = response_cache_key(model, contents, config)
+    text = llm_cache.get(key)
+    if text is not None:
+        task_router.record_cache_hit(task)
+        return _cached_response(text, config)
+
+    started = time.monotonic()
+    try:
+        response = hedge_policy.run(
+            task, model, lambda name: generate_content(client, name, contents, config, priority, deadline)
+        )
+    except Exception:
+        task_router.record_error(task)
+        raise
+    task_router.record(task, time.monotonic() - started, getattr(response, "usage_metadata", None))
+    if is_cacheable(response, config, cacheable):
+        llm_cache.put(key, response.text)
+    return response
+
+
+async def agenerate_content_cached(client, model=None, contents=None, config=None, priority=PRIORITY_DEFAULT,
+                                   deadline=None, task=None, cacheable=None):
+    """Async variant of generate_content_cached using client.aio"""
+    model = task_router.model(task, model)
+    config = task_router.config(task, config)
+    deadline = task_router.deadline(task, deadline)
+    key = response_cache_key(model, contents, config)
+    text = await asyncio.to_thread(llm_cache.get, key)
+    if text is not None:
+        task_router.record_cache_hit(task)
+        return _cached_response(text, config)
+
+    started = time.monotonic()
+    try:
+        response = await hedge_policy.arun(
+            task, model, lambda name: agenerate_content(client, name, contents, config, priority, deadline)
+        )
+    except Exception:
+        task_router.record_error(task)
+        raise
+    task_router.record(task, time.monotonic() - started, getattr(response, "usage_metadata", None))
+    if is_cacheable(response, config, cacheable):
+        await asyncio.to_thread(llm_cache.put, key, response.text)
+    return response
+
+
+# Create a global instance of the response cache
+llm_cache = LLMResponseCache()
@@ -0,0 +1,73 @@
+"""
+Process-wide registry of google-genai clients.
+
+The API-key client (Gemini Developer API) and the Vertex AI client (needed
+for the RAG corpus tool) are created once and reused, so every call shares
+their HTTP connection pools instead of building a new client, re-reading
+credentials and opening new TLS connections per request.
+
+Both expose the async surface as `client.aio`. Use it from the server's
+event loop only: code running in worker threads with its own short-lived
+loop (e.g. fanout.run_map_bounded) should use the sync client.
+"""
+import inspect
+import os
+import threading
+
+from dotenv import load_dotenv
+from google import genai
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
+VERTEX_PROJECT = os.getenv("VERTEX_PROJECT", "hackathons-423418")
+VERTEX_LOCATION = os.getenv("VERTEX_LOCATION", "us-central1")  # Must match the RAG corpus location
+
+
+class GenAIClientRegistry:
+    """Creates each kind of genai client once, on first use"""
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, factory):
+        with self._lock:
+            client = self._clients.get(kind)
+            if client is None:
+                client = factory()
+                self._clients[kind] = client
+            return client
+
+    def api_key_client(self):
+        """Client for the Gemini Developer API (NEXT_PUBLIC_GEMINI_API_KEY)"""
+        return self._get("api_key", lambda: genai.Client(api_key=GEMINI_API_KEY))
+
+    def vertex_client(self):
+        """Vertex AI client, required for the RAG corpus retrieval tool"""
+        return self._get("vertex", lambda: genai.Client(
+            vertexai=True,
+            project=VERTEX_PROJECT,
+            location=VERTEX_LOCATION,
+        ))
+
+    async def aclose(self):
+        """Close the async and sync HTTP clients of every created client"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                aclose = getattr(client.aio, "aclose", None)
+                if aclose is not None:
+                    result = aclose()
+                    if inspect.isawaitable(result):
+                        await result
+                close = getattr(client, "close", None)
+                if close is not None:
+                    close()
+            except Exception as e:
+                print(f"Error closing genai client: {e}")
+
+
+# Create a global instance of the client registry
+llm_clients = GenAIClientRegistry()
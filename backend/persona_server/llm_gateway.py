@@ -0,0 +1,423 @@
+"""
+Single gateway for every Gemini call made by this process.
+
+Each call goes through, in order:
+
+1. A priority-aware concurrency limit (LLM_MAX_CONCURRENCY slots). When all
+   slots are taken, waiting calls are admitted by priority, so interactive
+   chat is not queued behind a burst of report analyses.
+2. A token bucket per (model, key) holding the request rate at the quota
+   (LLM_RPM, requests per minute). A 429 empties the bucket, so every
+   caller of that model backs off instead of hammering the quota.
+3. Retries with exponential backoff and full jitter on rate limits, server
+   errors and timeouts (LLM_MAX_RETRIES).
+4. A deadline covering the queueing, the rate-limit waits and every attempt
+   (LLM_DEADLINE seconds unless the caller passes one).
+
+Works from the server's event loop (acall / astream) and from worker threads
+(call); the limits are shared between both.
+
+LLM_RPM overrides the default rate per model or per model and key, e.g.
+"gemini-2.0-flash=2000,gemini-2.0-flash@vertex=600".
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import os
+import random
+import threading
+import time
+
+from google.genai import types
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", "1000"))
+LLM_RPM = os.getenv("LLM_RPM", "")
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "120"))
+
+# Lower values are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BATCH = 10
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"ConnectError", "ConnectTimeout", "ReadError", "ReadTimeout", "RemoteProtocolError", "PoolTimeout"}
+
+
+def parse_rpm_overrides(value):
+    """Parse "model=rpm,model@key=rpm" into {"model": rpm, "model@key": rpm}"""
+    overrides = {}
+    for item in value.split(","):
+        name, _, rpm = item.strip().partition("=")
+        if name and rpm:
+            overrides[name.strip()] = float(rpm)
+    return overrides
+
+
+def status_code(error):
+    """HTTP status of a google-genai / httpx error, if it has one"""
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_retryable(error):
+    """Rate limits, server errors, timeouts and dropped connections"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if status_code(error) in RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait=None):
+        """
+        Take one token, possibly ahead of time.
+
+        Returns:
+            float: Seconds the caller must wait before using the token, or
+                None (nothing taken) if that is longer than max_wait
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def penalize(self, seconds):
+        """Hand out no tokens for the next `seconds` (after a 429)"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    """A queued acquire; woken through an Event (threads) or a Future (asyncio)"""
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.abandoned = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+class PrioritySemaphore:
+    """
+    Semaphore shared by threads and event loops that admits waiters by
+    priority (lowest first), then in arrival order.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._available = self.limit
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, priority, waiter):
+        with self._lock:
+            if self._available > 0:
+                self._available -= 1
+                return True
+            heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+            return False
+
+    def _abandon(self, waiter):
+        """Give up a queued acquire; False if the slot was granted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.abandoned = True
+            return True
+
+    def acquire(self, priority=PRIORITY_DEFAULT, timeout=None):
+        waiter = _Waiter()
+        if self._try_acquire(priority, waiter):
+            return
+        if waiter.event.wait(timeout) or not self._abandon(waiter):
+            return
+        raise TimeoutError(f"no LLM slot free within {timeout:.1f}s")
+
+    async def aacquire(self, priority=PRIORITY_DEFAULT, timeout=None):
+        waiter = _Waiter(asyncio.get_running_loop())
+        if self._try_acquire(priority, waiter):
+            return
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if not self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        while True:
+            with self._lock:
+                waiter = None
+                while self._waiters:
+                    _, _, candidate = heapq.heappop(self._waiters)
+                    if not candidate.abandoned:
+                        candidate.granted = True
+                        waiter = candidate
+                        break
+                if waiter is None:
+                    self._available += 1
+                    return
+            try:
+                waiter.wake()
+                return
+            except RuntimeError:
+                # The waiter's event loop is gone; hand the slot to the next one
+                continue
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self.limit - self._available,
+                "waiting": sum(1 for _, _, waiter in self._waiters if not waiter.abandoned),
+            }
+
+
+class LLMGateway:
+    """Concurrency, rate limits, retries and deadlines for LLM calls"""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, default_rpm=LLM_DEFAULT_RPM,
+                 rpm_overrides=None, burst=LLM_RATE_BURST, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX, deadline=LLM_DEADLINE):
+        self.default_rpm = default_rpm
+        self.rpm_overrides = parse_rpm_overrides(LLM_RPM) if rpm_overrides is None else rpm_overrides
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._slots = PrioritySemaphore(max_concurrency)
+        self._buckets = {}
+        self._counters = {"calls": 0, "retries": 0, "rate_limited": 0, "failures": 0, "deadline_exceeded": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def bucket(self, model, key):
+        """The token bucket of a (model, key) pair"""
+        name = f"{model}@{key}"
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                rpm = self.rpm_overrides.get(name, self.rpm_overrides.get(model, self.default_rpm))
+                bucket = TokenBucket(rpm / 60.0, self.burst)
+                self._buckets[name] = bucket
+            return bucket
+
+    def _expires(self, deadline):
+        return time.monotonic() + (self.deadline if deadline is None else deadline)
+
+    def _remaining(self, expires):
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            self._count("deadline_exceeded")
+            raise TimeoutError("LLM call deadline exceeded")
+        return remaining
+
+    def _token_wait(self, model, key, expires):
+        wait = self.bucket(model, key).reserve(max_wait=self._remaining(expires))
+        if wait is None:
+            self._count("deadline_exceeded")
+            raise TimeoutError(f"rate limit for {model} leaves no time before the deadline")
+        return wait
+
+    def _retry_delay(self, error, model, key, attempt, expires):
+        """Backoff before the next attempt; re-raises when not retrying"""
+        code = status_code(error)
+        if code == 429:
+            self._count("rate_limited")
+        if not is_retryable(error) or attempt >= self.max_retries:
+            self._count("failures")
+            raise error
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if code == 429:
+            self.bucket(model, key).penalize(delay)
+        if time.monotonic() + delay >= expires:
+            self._count("failures")
+            raise error
+        self._count("retries")
+        print(f"Retrying {model} call in {delay:.2f}s (attempt {attempt + 1}): {error}")
+        return delay
+
+    def call(self, fn, model, key="default", priority=PRIORITY_DEFAULT, deadline=None):
+        """
+        Run a blocking LLM call through the gateway.
+
+        Args:
+            fn: Called as fn(remaining_seconds) for every attempt
+            model (str): Model name, for the rate limit
+            key (str): API key / client the call is billed to
+            priority (int): Admission priority, lower first
+            deadline (float): Seconds for the whole call including retries
+
+        Returns:
+            Whatever fn returns
+        """
+        expires = self._expires(deadline)
+        self._count("calls")
+        attempt = 0
+        while True:
+            self._slots.acquire(priority, self._remaining(expires))
+            try:
+                time.sleep(self._token_wait(model, key, expires))
+                return fn(self._remaining(expires))
+            except Exception as e:
+                error = e
+            finally:
+                self._slots.release()
+            time.sleep(self._retry_delay(error, model, key, attempt, expires))
+            attempt += 1
+
+    async def acall(self, fn, model, key="default", priority=PRIORITY_DEFAULT, deadline=None):
+        """Async variant of call; fn() returns an awaitable"""
+        expires = self._expires(deadline)
+        self._count("calls")
+        attempt = 0
+        while True:
+            await self._slots.aacquire(priority, self._remaining(expires))
+            try:
+                await asyncio.sleep(self._token_wait(model, key, expires))
+                return await asyncio.wait_for(fn(), self._remaining(expires))
+            except Exception as e:
+                error = e
+            finally:
+                self._slots.release()
+            await asyncio.sleep(self._retry_delay(error, model, key, attempt, expires))
+            attempt += 1
+
+    async def astream(self, fn, model, key="default", priority=PRIORITY_DEFAULT, deadline=None):
+        """
+        Stream through the gateway. fn() returns an async iterator (or an
+        awaitable of one). A failed attempt is only retried if it had not
+        produced anything yet; the slot is held until the stream ends.
+        """
+        expires = self._expires(deadline)
+        self._count("calls")
+        attempt = 0
+        while True:
+            await self._slots.aacquire(priority, self._remaining(expires))
+            started = False
+            try:
+                await asyncio.sleep(self._token_wait(model, key, expires))
+                stream = fn()
+                if inspect.isawaitable(stream):
+                    stream = await asyncio.wait_for(stream, self._remaining(expires))
+                iterator = stream.__aiter__()
+                while True:
+                    try:
+                        item = await asyncio.wait_for(iterator.__anext__(), self._remaining(expires))
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield item
+            except Exception as e:
+                if started:
+                    self._count("failures")
+                    raise
+                error = e
+            finally:
+                self._slots.release()
+            await asyncio.sleep(self._retry_delay(error, model, key, attempt, expires))
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            buckets = {name: round(bucket.rate * 60) for name, bucket in self._buckets.items()}
+        return {**counters, **self._slots.stats(), "rpm": buckets}
+
+
+def client_key(client):
+    """Rate-limit key of a google-genai client"""
+    return "vertex" if getattr(client, "vertexai", False) else "api_key"
+
+
+def with_timeout(config, seconds):
+    """Copy of a GenerateContentConfig whose HTTP timeout fits in `seconds`"""
+    timeout_ms = max(1000, int(seconds * 1000))
+    if config is None:
+        return types.GenerateContentConfig(http_options=types.HttpOptions(timeout=timeout_ms))
+    http_options = config.http_options
+    if http_options is not None and http_options.timeout is not None and http_options.timeout <= timeout_ms:
+        return config
+    if http_options is None:
+        http_options = types.HttpOptions(timeout=timeout_ms)
+    else:
+        http_options = http_options.model_copy(update={"timeout": timeout_ms})
+    return config.model_copy(update={"http_options": http_options})
+
+
+def generate_content(client, model, contents, config=None, priority=PRIORITY_DEFAULT, deadline=None):
+    """client.models.generate_content through the gateway"""
+    return llm_gateway.call(
+        lambda remaining: client.models.generate_content(
+            model=model, contents=contents, config=with_timeout(config, remaining)
+        ),
+        model, client_key(client), priority, deadline,
+    )
+
+
+async def agenerate_content(client, model, contents, config=None, priority=PRIORITY_DEFAULT, deadline=None):
+    """client.aio.models.generate_content through the gateway"""
+    return await llm_gateway.acall(
+        lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+        model, client_key(client), priority, deadline,
+    )
+
+
+def agenerate_content_stream(client, model, contents, config=None, priority=PRIORITY_DEFAULT, deadline=None):
+    """client.aio.models.generate_content_stream through the gateway (async iterator)"""
+    return llm_gateway.astream(
+        lambda: client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+        model, client_key(client), priority, deadline,
+    )
+
+
+# Create a global instance of the gateway
+llm_gateway = LLMGateway()
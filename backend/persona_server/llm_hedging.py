@@ -0,0 +1,212 @@
+"""
+Optional request hedging for LLM calls with a long latency tail.
+
+For the tasks listed in LLM_HEDGE_TASKS ("*" for all), a call that is still
+running after the task's recent LLM_HEDGE_PERCENTILE latency gets a
+duplicate, sent to the fallback model configured for the task (or the same
+model), and whichever finishes first successfully wins; the other is
+cancelled (async, or a sync hedge still queued) or left to finish and
+ignored (a sync call already running). Both requests go through the LLM
+gateway, so hedges count against the same rate limits.
+
+Sync primaries start right away on a thread of their own, so the hedge delay
+measures the call itself; only hedges go to the LLM_HEDGE_WORKERS pool, and
+queueing behind other fan-outs never triggers a hedge.
+
+Until a task has LLM_HEDGE_MIN_SAMPLES latencies recorded, the hedge fires
+after LLM_HEDGE_INITIAL_DELAY seconds.
+
+    LLM_HEDGE_TASKS=rag_profile,markdown_conversion
+    LLM_HEDGE_FALLBACK=rag_profile=gemini-2.0-flash-lite
+
+Per-task counters (calls, hedges fired, which side won) are reported by
+hedge_policy.stats().
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+LLM_HEDGE_TASKS = os.getenv("LLM_HEDGE_TASKS", "")
+LLM_HEDGE_FALLBACK = os.getenv("LLM_HEDGE_FALLBACK", "")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "15"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "8"))
+
+
+def _parse_tasks(value):
+    return {task.strip() for task in value.split(",") if task.strip()}
+
+
+def _parse_fallbacks(value):
+    fallbacks = {}
+    for item in value.split(","):
+        task, _, model = item.strip().partition("=")
+        if task and model:
+            fallbacks[task.strip()] = model.strip()
+    return fallbacks
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class HedgePolicy:
+    """Per-task hedging toggles, latency windows and win counters"""
+
+    def __init__(self, tasks=None, fallbacks=None, pct=LLM_HEDGE_PERCENTILE,
+                 min_samples=LLM_HEDGE_MIN_SAMPLES, initial_delay=LLM_HEDGE_INITIAL_DELAY,
+                 min_delay=LLM_HEDGE_MIN_DELAY, window=LLM_HEDGE_WINDOW, workers=LLM_HEDGE_WORKERS):
+        self.tasks = _parse_tasks(LLM_HEDGE_TASKS) if tasks is None else set(tasks)
+        self.fallbacks = _parse_fallbacks(LLM_HEDGE_FALLBACK) if fallbacks is None else fallbacks
+        self.pct = pct
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.window = window
+        self.workers = workers
+        self._latencies = {}
+        self._counters = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def enabled(self, task):
+        return bool(task) and ("*" in self.tasks or task in self.tasks)
+
+    def fallback_model(self, task, model):
+        return self.fallbacks.get(task, model)
+
+    def delay(self, task):
+        """Seconds to wait for the primary before hedging"""
+        with self._lock:
+            samples = list(self._latencies.get(task, ()))
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, percentile(samples, self.pct))
+
+    def _record(self, task, seconds):
+        with self._lock:
+            samples = self._latencies.get(task)
+            if samples is None:
+                samples = self._latencies[task] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def _count(self, task, name):
+        with self._lock:
+            counters = self._counters.setdefault(
+                task, {"calls": 0, "hedged": 0, "primary_wins": 0, "hedge_wins": 0, "failures": 0}
+            )
+            counters[name] += 1
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(2, self.workers), thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def _start_primary(self, fn, model):
+        """Start fn(model) immediately on its own thread; returns its Future"""
+        future = Future()
+
+        def call():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(model))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=call, name="llm-hedge-primary", daemon=True).start()
+        return future
+
+    def run(self, task, model, fn):
+        """
+        Call fn(model) with hedging, from a worker thread.
+
+        Args:
+            task (str): Task name, for the toggle, latency window and counters
+            model (str): Model of the primary request
+            fn: Blocking call, fn(model_name) -> result
+
+        Returns:
+            The first successful result
+        """
+        if not self.enabled(task):
+            return fn(model)
+
+        self._count(task, "calls")
+        started = time.monotonic()
+        primary = self._start_primary(fn, model)
+        done, _ = wait([primary], timeout=self.delay(task))
+        if not done:
+            self._count(task, "hedged")
+            hedge = self._get_executor().submit(fn, self.fallback_model(task, model))
+            pending = {primary, hedge}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is None:
+                            return self._won(task, started, future is hedge, future.result())
+            finally:
+                # A hedge still queued never runs; a running call is ignored
+                for future in pending:
+                    future.cancel()
+            self._count(task, "failures")
+            return primary.result()
+        if primary.exception() is not None:
+            self._count(task, "failures")
+        return self._won(task, started, False, primary.result())
+
+    async def arun(self, task, model, fn):
+        """Async variant of run; fn(model_name) returns an awaitable"""
+        if not self.enabled(task):
+            return await fn(model)
+
+        self._count(task, "calls")
+        started = time.monotonic()
+        primary = asyncio.ensure_future(fn(model))
+        done, _ = await asyncio.wait({primary}, timeout=self.delay(task))
+        if not done:
+            self._count(task, "hedged")
+            hedge = asyncio.ensure_future(fn(self.fallback_model(task, model)))
+            pending = {primary, hedge}
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task_future in done:
+                        if task_future.exception() is None:
+                            return self._won(task, started, task_future is hedge, task_future.result())
+            finally:
+                for task_future in pending:
+                    task_future.cancel()
+            self._count(task, "failures")
+            return primary.result()
+        if primary.exception() is not None:
+            self._count(task, "failures")
+        return self._won(task, started, False, primary.result())
+
+    def _won(self, task, started, by_hedge, result):
+        self._record(task, time.monotonic() - started)
+        self._count(task, "hedge_wins" if by_hedge else "primary_wins")
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = {task: dict(values) for task, values in self._counters.items()}
+            tasks = sorted(self.tasks)
+        for task in counters:
+            counters[task]["hedge_delay"] = round(self.delay(task), 3)
+        return {"tasks": tasks, "fallbacks": dict(self.fallbacks), "per_task": counters}
+
+
+# Create a global instance of the hedging policy
+hedge_policy = HedgePolicy()
@@ -0,0 +1,197 @@
+"""
+Per-task model routing: which model, output cap, temperature, deadline and
+input budget each LLM task uses, plus per-task latency and token usage.
+
+Defaults are in DEFAULT_ROUTES. Any field can be overridden per task with
+LLM_ROUTES, a JSON object keyed by task name:
+
+    LLM_ROUTES='{"chat": {"model": "gemini-2.5-flash", "max_output_tokens": 2048},
+                 "markdown_conversion": {"model": "gemini-2.0-flash"}}'
+
+`timeout` is the deadline in seconds for the whole call, retries included
+(see llm_gateway). `max_input_tokens` is the prompt budget used by
+prompt_builder. A None field leaves the model default in place (no budget).
+"""
+import json
+import os
+import threading
+from collections import deque
+
+from google.genai import types
+
+DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gemini-2.0-flash")
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gemini-2.0-flash-lite")
+LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+LLM_METRICS_WINDOW = int(os.getenv("LLM_METRICS_WINDOW", "500"))
+
+
+class TaskRoute:
+    """Model and generation limits of one task"""
+
+    FIELDS = ("model", "max_output_tokens", "temperature", "timeout", "max_input_tokens")
+
+    def __init__(self, model=DEFAULT_MODEL, max_output_tokens=None, temperature=None, timeout=None,
+                 max_input_tokens=None):
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+        self.max_input_tokens = max_input_tokens
+
+    def updated(self, overrides):
+        """Copy with the given fields replaced"""
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        values.update({key: value for key, value in overrides.items() if key in self.FIELDS})
+        return TaskRoute(**values)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+# Journal emotion scores are returned by the journal_analysis call itself
+DEFAULT_ROUTES = {
+    # persona_server
+    "journal_analysis": TaskRoute(DEFAULT_MODEL, max_output_tokens=4096, temperature=0.3, timeout=90),
+    "journal_batch_analysis": TaskRoute(DEFAULT_MODEL, max_output_tokens=8192, temperature=0.3, timeout=120),
+    "summary": TaskRoute(DEFAULT_MODEL, max_output_tokens=2048, temperature=0.4, timeout=90),
+    "markdown_conversion": TaskRoute(FAST_MODEL, max_output_tokens=4096, temperature=0.2, timeout=60,
+                                     max_input_tokens=30000),
+    "chat_extraction": TaskRoute(DEFAULT_MODEL, max_output_tokens=8192, temperature=0.2, timeout=90,
+                                 max_input_tokens=60000),
+    "info_extraction": TaskRoute(DEFAULT_MODEL, max_output_tokens=8192, temperature=0.2, timeout=60,
+                                 max_input_tokens=30000),
+    "graph_extraction": TaskRoute(DEFAULT_MODEL, max_output_tokens=2048, temperature=0.2, timeout=60,
+                                  max_input_tokens=30000),
+    "rag_profile": TaskRoute(DEFAULT_MODEL, max_output_tokens=4000, temperature=0.7, timeout=120,
+                             max_input_tokens=60000),
+    "chat": TaskRoute(DEFAULT_MODEL, max_output_tokens=1024, temperature=0.7, timeout=60),
+    # cassidy_adk agents
+    "answer_review": TaskRoute(DEFAULT_MODEL, max_output_tokens=256, temperature=0.2, timeout=30),
+    "follow_up": TaskRoute(DEFAULT_MODEL, max_output_tokens=256, temperature=0.7, timeout=30),
+    "progress": TaskRoute(DEFAULT_MODEL, max_output_tokens=2048, temperature=0.0, timeout=60),
+}
+
+
+def _parse_overrides(value):
+    if not value:
+        return {}
+    try:
+        overrides = json.loads(value)
+    except json.JSONDecodeError as e:
+        print(f"Ignoring invalid LLM_ROUTES: {e}")
+        return {}
+    return {task: fields for task, fields in overrides.items() if isinstance(fields, dict)}
+
+
+def _percentile(ordered, pct):
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class TaskRouter:
+    """Task -> route lookup and per-task call metrics"""
+
+    def __init__(self, routes=None, overrides=None, window=LLM_METRICS_WINDOW):
+        routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        overrides = _parse_overrides(LLM_ROUTES) if overrides is None else overrides
+        for task, fields in overrides.items():
+            routes[task] = routes.get(task, TaskRoute()).updated(fields)
+        self.routes = routes
+        self.window = window
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def route(self, task):
+        """The task's route (the default model with no limits for unknown tasks)"""
+        if not task:
+            return TaskRoute()
+        route = self.routes.get(task)
+        if route is None:
+            route = self.routes[task] = TaskRoute()
+        return route
+
+    def model(self, task, model=None):
+        """Explicit model if given, else the task's"""
+        return model or self.route(task).model
+
+    def config(self, task, base=None):
+        """
+        A GenerateContentConfig with the task's output cap and temperature.
+
+        Args:
+            task (str): Task name
+            base: Optional config whose other fields (schema, tools, safety
+                settings, ...) are kept
+
+        Returns:
+            GenerateContentConfig (or `base` unchanged if the task sets nothing)
+        """
+        route = self.route(task)
+        updates = {}
+        if route.max_output_tokens is not None:
+            updates["max_output_tokens"] = route.max_output_tokens
+        if route.temperature is not None:
+            updates["temperature"] = route.temperature
+        if not updates:
+            return base
+        if base is None:
+            return types.GenerateContentConfig(**updates)
+        return base.model_copy(update=updates)
+
+    def input_budget(self, task):
+        """The task's prompt budget in tokens (None for no limit)"""
+        return self.route(task).max_input_tokens
+
+    def deadline(self, task, deadline=None):
+        """Explicit deadline if given, else the task's timeout"""
+        return deadline if deadline is not None else self.route(task).timeout
+
+    def _task_metrics(self, task):
+        metrics = self._metrics.get(task)
+        if metrics is None:
+            metrics = self._metrics[task] = {
+                "calls": 0, "errors": 0, "cache_hits": 0,
+                "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+                "latencies": deque(maxlen=self.window),
+            }
+        return metrics
+
+    def record(self, task, seconds, usage=None):
+        """Record one completed model call and its usage_metadata"""
+        if not task:
+            return
+        with self._lock:
+            metrics = self._task_metrics(task)
+            metrics["calls"] += 1
+            metrics["latencies"].append(seconds)
+            if usage is not None:
+                metrics["prompt_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+                metrics["output_tokens"] += getattr(usage, "candidates_token_count", None) or 0
+                metrics["total_tokens"] += getattr(usage, "total_token_count", None) or 0
+
+    def record_error(self, task):
+        if task:
+            with self._lock:
+                self._task_metrics(task)["errors"] += 1
+
+    def record_cache_hit(self, task):
+        if task:
+            with self._lock:
+                self._task_metrics(task)["cache_hits"] += 1
+
+    def stats(self):
+        with self._lock:
+            per_task = {}
+            for task, metrics in self._metrics.items():
+                latencies = sorted(metrics["latencies"])
+                values = {key: value for key, value in metrics.items() if key != "latencies"}
+                if latencies:
+                    values["latency_p50"] = round(_percentile(latencies, 50), 3)
+                    values["latency_p95"] = round(_percentile(latencies, 95), 3)
+                per_task[task] = values
+            routes = {task: route.to_dict() for task, route in self.routes.items()}
+        return {"routes": routes, "per_task": per_task}
+
+
+# Create a global instance of the task router
+task_router = TaskRouter()
@@ -1,10 +1,11 @@
 from datetime import datetime
 import uuid
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 import os
+import time
 import json
 from tempfile import NamedTemporaryFile
 import base64
@@ -16,9 +17,21 @@ import base64
 from tempfile import NamedTemporaryFile
 from fastapi.responses import JSONResponse
 from data import create_pdf_from_json_chat
-from chat import reflection_chatbot
-from dataSync import isPersonaUpdateNeeded, personaInfo, updatePersona
+from chat import reflection_chatbot, stream_reflection_chatbot
+from dataSync import updatePersona
+from unit_of_work import UserUnitOfWork
 from email_queue import email_queue
+from firestore_client import firestore_pool
+from llm_clients import llm_clients
+from llm_cache import llm_cache
+from llm_gateway import llm_gateway
+from llm_hedging import hedge_policy
+from llm_routing import task_router
+from prompt_builder import prompt_metrics
+from repository import storage
+from persona_cache import persona_cache_stats
+from persona_listeners import persona_listeners
+from encryption import key_cache_stats
 import json
 
 app = FastAPI()
@@ -47,11 +60,34 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup_event():
+    # Open the shared Firestore clients once instead of per request
+    if storage.backend == "firestore":
+        firestore_pool.start()
+    await persona_listeners.start()
     await email_queue.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     await email_queue.stop()
+    await persona_listeners.stop()
+    await firestore_pool.aclose()
+    await llm_clients.aclose()
+    llm_cache.close()
+    storage.close()
+
+@app.get("/stats")
+async def stats():
+    # In-process cache hit rates, for checking the caches are doing their job
+    return JSONResponse(content={
+        "persona_cache": persona_cache_stats(),
+        "encryption_key_cache": key_cache_stats(),
+        "persona_listeners": persona_listeners.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "llm_hedging": hedge_policy.stats(),
+        "llm_tasks": task_router.stats(),
+        "prompts": prompt_metrics.stats(),
+    }, status_code=200)
 
 @app.post("/getReport")
 async def get_report(request: Request):
@@ -63,9 +99,16 @@ async def get_report(request: Request):
         if not authId:
             return JSONResponse(content={"error": "Missing authId or email in request"}, status_code=400)
 
-        # If update is needed → update and return, skip further processing
-        if isPersonaUpdateNeeded(authId):
-            info_json, graph_json = await updatePersona(authId)
+        # One read of the user document is shared by the whole request. Only
+        # the flag is fetched up front; updatePersona loads the full document.
+        uow = UserUnitOfWork(authId)
+        await uow.load(field_paths=["updatePersona"])
+
+        # If update is needed → update and return, skip further processing.
+        # fullRefresh rebuilds the persona from the whole history.
+        full_refresh = bool(payload.get("fullRefresh"))
+        if full_refresh or uow.is_persona_update_needed():
+            info_json, graph_json = await updatePersona(authId, uow=uow, full_refresh=full_refresh)
             # Step: Generate PDF report from saved persona data
             data = {
                 "info": info_json,
@@ -79,11 +122,10 @@ async def get_report(request: Request):
             }, status_code=200)
 
         # Otherwise, fetch stored persona info and proceed to report/email
-        persona_raw = personaInfo(authId)
-        if not persona_raw:
+        persona_data = await uow.get_persona_data()
+        if not persona_data:
             return JSONResponse(content={"error": "Stored persona data not found"}, status_code=404)
 
-        persona_data = json.loads(persona_raw)
         info_json = persona_data.get("Info")
         graph_json = persona_data.get("Graph")
 
@@ -115,9 +157,16 @@ async def get_report(request: Request):
         if not authId or not user_email:
             return JSONResponse(content={"error": "Missing authId or email in request"}, status_code=400)
 
-        # If update is needed → update and return, skip further processing
-        if isPersonaUpdateNeeded(authId):
-            info_json, graph_json = await updatePersona(authId)
+        # One read of the user document is shared by the whole request. Only
+        # the flag is fetched up front; updatePersona loads the full document.
+        uow = UserUnitOfWork(authId)
+        await uow.load(field_paths=["updatePersona"])
+
+        # If update is needed → update and return, skip further processing.
+        # fullRefresh rebuilds the persona from the whole history.
+        full_refresh = bool(payload.get("fullRefresh"))
+        if full_refresh or uow.is_persona_update_needed():
+            info_json, graph_json = await updatePersona(authId, uow=uow, full_refresh=full_refresh)
             # Step: Generate PDF report from saved persona data
             data = {
                 "info": info_json,
@@ -126,7 +175,7 @@ async def get_report(request: Request):
 
             with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
                 pdf_path = tmp.name
-                create_pdf_from_json(data, pdf_path)
+                await asyncio.to_thread(create_pdf_from_json, data, pdf_path)
 
             # Add email to queue
             await email_queue.add_email({
@@ -142,11 +191,10 @@ async def get_report(request: Request):
             }, status_code=200)
 
         # Otherwise, fetch stored persona info and proceed to report/email
-        persona_raw = personaInfo(authId)
-        if not persona_raw:
+        persona_data = await uow.get_persona_data()
+        if not persona_data:
             return JSONResponse(content={"error": "Stored persona data not found"}, status_code=404)
 
-        persona_data = json.loads(persona_raw)
         info_json = persona_data.get("Info")
         graph_json = persona_data.get("Graph")
 
@@ -161,7 +209,7 @@ async def get_report(request: Request):
 
         with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
             pdf_path = tmp.name
-            create_pdf_from_json(data, pdf_path)
+            await asyncio.to_thread(create_pdf_from_json, data, pdf_path)
 
         # Add email to queue
         await email_queue.add_email({
@@ -179,24 +227,39 @@ async def get_report(request: Request):
     except Exception as e:
         return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
 
+async def load_chat_persona(authId, user_message):
+    """
+    Return (persona_info, persona_updated) for a chat request.
+
+    A stored persona is used as-is (served from the in-process cache when
+    warm); the update flag is only read when there is none yet, and then the
+    persona is built first.
+    """
+    uow = UserUnitOfWork(authId)
+    user_info = await uow.get_persona_info()
+    if user_info is not None:
+        return user_info, False
+
+    await uow.load(field_paths=["updatePersona"])
+    if not uow.is_persona_update_needed():
+        return None, False
+
+    await updatePersona(authId, user_message, uow=uow)
+    return await uow.get_persona_info(), True
+
 @app.post("/chat")
 async def chat(request: Request):
     try:
         payload = await request.json()
         authId = payload.get("authId")
         user_message = payload.get("userMessage")
-        user_info = personaInfo(authId)
 
         if not authId or not user_message:
             return JSONResponse(content={"error": "Missing authId or userMessage in request"}, status_code=400)
 
-        if not isPersonaUpdateNeeded(authId) or not user_info is None:
-            # Generate RAG response
-            rag_response = reflection_chatbot(user_message=user_message, user_info=user_info)
-        else:
-            # Update persona and then generate RAG response
-            updatePersona(authId, user_message)
-            rag_response = reflection_chatbot(user_message=user_message, user_info=user_info)
+        user_info, _ = await load_chat_persona(authId, user_message)
+        # Generate RAG response
+        rag_response = await reflection_chatbot(user_message=user_message, user_info=user_info)
         if not rag_response:
             return JSONResponse(content={"error": "No response generated"}, status_code=404)
 
@@ -208,6 +271,62 @@ async def chat(request: Request):
 
 
 
+def format_stream_event(event, data, stream_format):
+    """Encode one streaming event as an SSE message or an NDJSON line"""
+    if stream_format == "ndjson":
+        return json.dumps({"type": event, **data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Streaming variant of /chat. Reply chunks are sent as they arrive from the
+    model, as Server-Sent Events (default) or NDJSON ("format": "ndjson"):
+    "chunk" events carry {"text"}, a final "done" event carries metadata
+    (timings, token usage, finish reason) and an "error" event replaces it if
+    generation fails mid-stream.
+    """
+    try:
+        payload = await request.json()
+        authId = payload.get("authId")
+        user_message = payload.get("userMessage")
+        stream_format = payload.get("format", "sse")
+
+        if not authId or not user_message:
+            return JSONResponse(content={"error": "Missing authId or userMessage in request"}, status_code=400)
+        if stream_format not in ("sse", "ndjson"):
+            return JSONResponse(content={"error": "format must be 'sse' or 'ndjson'"}, status_code=400)
+
+        started = time.perf_counter()
+        user_info, persona_updated = await load_chat_persona(authId, user_message)
+
+    except Exception as e:
+        return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
+
+    async def events():
+        metadata = {"persona_updated": persona_updated}
+        first_chunk_at = None
+        chunks = 0
+        try:
+            async for text in stream_reflection_chatbot(user_info=user_info, user_message=user_message, metadata=metadata):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                chunks += 1
+                yield format_stream_event("chunk", {"text": text}, stream_format)
+        except Exception as e:
+            yield format_stream_event("error", {"error": f"Internal server error: {str(e)}"}, stream_format)
+            return
+
+        metadata["chunks"] = chunks
+        metadata["time_to_first_chunk_ms"] = (
+            round((first_chunk_at - started) * 1000, 1) if first_chunk_at is not None else None
+        )
+        metadata["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield format_stream_event("done", metadata, stream_format)
+
+    media_type = "application/x-ndjson" if stream_format == "ndjson" else "text/event-stream"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/getMindLogReport")
 async def get_report(request: Request):
     try:
@@ -225,7 +344,7 @@ async def get_report(request: Request):
         filename = f"mindlog_{authId}_{timestamp}_{unique_id}"
         
         # Generate the report
-        result = gen_mindlogpdf(authId, numdays, filename)
+        result = await asyncio.to_thread(gen_mindlogpdf, authId, numdays, filename)
         
         # Check if report generation was successful
         if not result["success"]:
@@ -304,13 +423,13 @@ async def get_report(request: Request):
         user_email = payload.get("email")
 
         # Step 1: Extract chat + journal data
-        chat_data = data_chat_extraction(authId, "json")
-        md_data = json_to_md(chat_data)
+        chat_data = await asyncio.to_thread(data_chat_extraction, authId, "json")
+        md_data = await asyncio.to_thread(json_to_md, chat_data)
 
         # Step 2: Generate PDF into a temp file
         with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
             pdf_path = tmp.name
-            save_to_pdf(md_data, pdf_path)
+            await asyncio.to_thread(save_to_pdf, md_data, pdf_path)
 
         # Add email to queue
         await email_queue.add_email({
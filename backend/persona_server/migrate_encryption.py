@@ -0,0 +1,174 @@
+"""
+Re-encrypts existing userHistory messages and journal entries from the v1
+format (per-value salt, one PBKDF2 per field) to the v2 envelope (one wrapped
+per-user data key, each value carrying only a key id and a nonce).
+
+Values that are already v2, unencrypted or cannot be decrypted are left as-is.
+Every client that reads these fields must understand v2 before this is run.
+
+Usage:
+    python migrate_encryption.py                  # all users
+    python migrate_encryption.py --users UID1 UID2
+    python migrate_encryption.py --dry-run
+"""
+import argparse
+
+from google.cloud import firestore
+
+from encryption import create_data_key, decrypt, decrypt_many, encrypt, is_v2
+from firestore_client import firestore_pool, get_db
+
+# Firestore allows at most 500 writes per batch
+BATCH_LIMIT = 500
+
+
+def ensure_data_key(user_ref, user_data, user_email, dry_run=False):
+    """
+    Returns (key_id, data_keys) for the user, creating and storing a data key if needed
+    """
+    data_keys = dict(user_data.get("dataKeys") or {})
+    key_id = user_data.get("dataKeyId")
+    if key_id and key_id in data_keys:
+        return key_id, data_keys
+
+    key_id, wrapped_key = create_data_key(user_email)
+    data_keys[key_id] = wrapped_key
+    if not dry_run:
+        user_ref.set({"dataKeys": {key_id: wrapped_key}, "dataKeyId": key_id}, merge=True)
+    return key_id, data_keys
+
+
+def reencrypt(value, user_email, data_keys, key_id):
+    """
+    Returns the v2 form of a v1 value, or None if it should be left unchanged
+    """
+    if not value or is_v2(value):
+        return None
+    try:
+        plaintext = decrypt(value, user_email)
+    except Exception as e:
+        print(f"  Skipping value that could not be decrypted: {e}")
+        return None
+    return encrypt(plaintext, user_email, data_keys, key_id)
+
+
+def reencrypt_many(values, user_email, data_keys, key_id):
+    """
+    Returns the v2 form of each value, or None for values that should be left
+    unchanged; the v1 values are decrypted in one decrypt_many batch
+    """
+    positions = [index for index, value in enumerate(values) if value and not is_v2(value)]
+    plaintexts = decrypt_many(
+        [values[index] for index in positions], user_email, fallback=[None] * len(positions)
+    )
+    results = [None] * len(values)
+    for index, plaintext in zip(positions, plaintexts):
+        if plaintext is not None:
+            results[index] = encrypt(plaintext, user_email, data_keys, key_id)
+    return results
+
+
+def migrate_history(db, user_ref, history, user_email, data_keys, key_id, dry_run=False):
+    """
+    Re-encrypts userHistory outside any transaction, then writes it back in a
+    transaction that only checks the array still starts with the messages
+    that were read, so concurrent appends are kept
+    """
+    values = [entry.get("encryptedMessage") if isinstance(entry, dict) else None for entry in history]
+    new_values = reencrypt_many(values, user_email, data_keys, key_id)
+    migrated = sum(1 for value in new_values if value is not None)
+    if not migrated or dry_run:
+        return migrated
+
+    new_history = [
+        entry if value is None else {**entry, "encryptedMessage": value}
+        for entry, value in zip(history, new_values)
+    ]
+
+    @firestore.transactional
+    def write_history(transaction):
+        snapshot = user_ref.get(field_paths=["userHistory"], transaction=transaction)
+        current = (snapshot.to_dict() or {}).get("userHistory") or []
+        if current[:len(history)] != history:
+            raise RuntimeError("userHistory was rewritten during migration; re-run to retry")
+        transaction.update(user_ref, {"userHistory": new_history + current[len(history):]})
+
+    write_history(db.transaction())
+    return migrated
+
+
+def migrate_journal(db, user_ref, user_email, data_keys, key_id, dry_run=False):
+    """
+    Rewrites encryptedTitle / encryptedContent of every journal entry in batches
+    """
+    migrated = 0
+    batch = db.batch()
+    pending = 0
+
+    for doc in user_ref.collection("journalEntries").stream():
+        entry_data = doc.to_dict() or {}
+        updates = {}
+        for field in ("encryptedTitle", "encryptedContent"):
+            new_value = reencrypt(entry_data.get(field), user_email, data_keys, key_id)
+            if new_value is not None:
+                updates[field] = new_value
+
+        if not updates:
+            continue
+
+        migrated += 1
+        if dry_run:
+            continue
+
+        batch.update(doc.reference, updates)
+        pending += 1
+        if pending == BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+    return migrated
+
+
+def migrate_user(db, authId, dry_run=False):
+    user_ref = db.collection("users").document(authId)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        print(f"User document not found for {authId}")
+        return
+
+    user_data = user_doc.to_dict()
+    user_email = user_data.get("email")
+    if not user_email:
+        print(f"User email not found for {authId} - skipping")
+        return
+
+    key_id, data_keys = ensure_data_key(user_ref, user_data, user_email, dry_run)
+    history = user_data.get("userHistory") or []
+    messages = migrate_history(db, user_ref, history, user_email, data_keys, key_id, dry_run)
+    entries = migrate_journal(db, user_ref, user_email, data_keys, key_id, dry_run)
+    print(f"{authId}: {messages} messages, {entries} journal entries migrated to v2")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate encrypted user data to the v2 envelope")
+    parser.add_argument("--users", nargs="*", help="authIds to migrate (default: all users)")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    db = get_db()
+    user_ids = args.users or [doc.id for doc in db.collection("users").list_documents()]
+
+    for authId in user_ids:
+        try:
+            migrate_user(db, authId, args.dry_run)
+        except Exception as e:
+            print(f"Failed to migrate user {authId}: {e}")
+
+    firestore_pool.close()
+
+
+if __name__ == "__main__":
+    main()
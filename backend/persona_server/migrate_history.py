@@ -0,0 +1,118 @@
+"""
+Moves each user's `userHistory` array into the ordered
+`users/{authId}/messages` subcollection (see storage.py).
+
+Messages are copied in batches first (document ids are derived from the
+message index, so re-running is idempotent). A transaction then checks that
+the array still starts with the copied messages, trims them from the array,
+and switches the user to `historyStorage: "messages"`. Messages appended
+while the copy was running stay in the array and are picked up on the next
+run. The last moved message is recorded as `historyLastMigrated`, so
+migrated messages a client writes back in front of the array are skipped
+when the tail is read and never migrated twice (see storage.history_tail).
+
+Do not run this until the web client reads the `messages` subcollection:
+the client still only reads `userHistory`, so migrated users would lose
+everything but the tail from its chat view. Its non-transactional
+read-modify-write of the array can also put the migrated messages back,
+which history_tail only hides from the servers.
+
+Usage:
+    python migrate_history.py                  # all users
+    python migrate_history.py --users UID1 UID2
+    python migrate_history.py --dry-run
+"""
+import argparse
+
+from google.cloud import firestore
+
+from firestore_client import firestore_pool, get_db
+from storage import LAST_MIGRATED_FIELD, MESSAGES_STORAGE, history_tail, message_doc_id, to_message_doc
+
+# Firestore allows at most 500 writes per batch
+BATCH_LIMIT = 500
+
+
+def copy_messages(db, user_ref, history, first_index):
+    """Write history entries to the messages subcollection starting at first_index"""
+    messages_ref = user_ref.collection("messages")
+    batch = db.batch()
+    pending = 0
+
+    for offset, entry in enumerate(history):
+        index = first_index + offset
+        batch.set(messages_ref.document(message_doc_id(index)), to_message_doc(index, entry))
+        pending += 1
+        if pending == BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+
+
+def migrate_user(db, authId, dry_run=False):
+    user_ref = db.collection("users").document(authId)
+    user_doc = user_ref.get(
+        field_paths=["userHistory", "historyMessageCount", "historyStorage", LAST_MIGRATED_FIELD]
+    )
+    if not user_doc.exists:
+        print(f"User document not found for {authId}")
+        return
+
+    user_data = user_doc.to_dict() or {}
+    history = history_tail(user_data)
+    first_index = user_data.get("historyMessageCount", 0)
+
+    if not history:
+        print(f"{authId}: nothing to migrate")
+        return
+    if dry_run:
+        print(f"{authId}: would move {len(history)} messages starting at index {first_index}")
+        return
+
+    copy_messages(db, user_ref, history, first_index)
+
+    @firestore.transactional
+    def switch_storage(transaction):
+        snapshot = user_ref.get(transaction=transaction)
+        current = history_tail(snapshot.to_dict())
+        if current[:len(history)] != history:
+            raise RuntimeError("userHistory was rewritten during migration; re-run to retry")
+
+        # Dropping a re-appended prefix here too keeps the array to the tail
+        transaction.update(user_ref, {
+            "userHistory": current[len(history):],
+            "historyMessageCount": first_index + len(history),
+            "historyStorage": MESSAGES_STORAGE,
+            LAST_MIGRATED_FIELD: history[-1],
+        })
+
+    switch_storage(db.transaction())
+    print(f"{authId}: moved {len(history)} messages to the messages subcollection")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move userHistory arrays into the messages subcollection. "
+                    "Only run once the web client reads the messages subcollection."
+    )
+    parser.add_argument("--users", nargs="*", help="authIds to migrate (default: all users)")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    db = get_db()
+    user_ids = args.users or [doc.id for doc in db.collection("users").list_documents()]
+
+    for authId in user_ids:
+        try:
+            migrate_user(db, authId, args.dry_run)
+        except Exception as e:
+            print(f"Failed to migrate user {authId}: {e}")
+
+    firestore_pool.close()
+
+
+if __name__ == "__main__":
+    main()
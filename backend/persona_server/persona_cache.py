@@ -0,0 +1,48 @@
+import json
+import os
+
+from cache import TTLCache
+
+# Parsed personas kept in memory, keyed by authId
+PERSONA_CACHE_SIZE = int(os.getenv("PERSONA_CACHE_SIZE", "1024"))
+PERSONA_CACHE_TTL = float(os.getenv("PERSONA_CACHE_TTL", "300"))
+
+persona_cache = TTLCache(max_size=PERSONA_CACHE_SIZE, ttl=PERSONA_CACHE_TTL)
+
+
+class CachedPersona:
+    """A stored persona document together with its parsed Info/Graph"""
+
+    def __init__(self, document):
+        self.document = document
+        self.parsed = None
+        try:
+            self.parsed = json.loads(document.get("Info"))
+        except (TypeError, ValueError):
+            pass
+
+    @property
+    def info(self):
+        """The raw persona JSON string as stored in Firestore"""
+        return self.document.get("Info")
+
+
+def get_cached_persona(authId):
+    return persona_cache.get(authId)
+
+
+def cache_persona(authId, document):
+    """Cache a persona document; returns the CachedPersona (or None)"""
+    if not document:
+        return None
+    cached = CachedPersona(document)
+    persona_cache.put(authId, cached)
+    return cached
+
+
+def invalidate_persona(authId):
+    persona_cache.invalidate(authId)
+
+
+def persona_cache_stats():
+    return persona_cache.stats()
@@ -0,0 +1,196 @@
+"""
+Optional Firestore snapshot listeners that keep the persona cache fresh
+across replicas.
+
+When PERSONA_LISTENERS is enabled, every user whose persona is requested is
+watched for PERSONA_LISTENER_IDLE seconds after their last request:
+
+- users/{authId}: when `updatePersona` flips to true (set by the web app or
+  another replica) the cached persona is evicted.
+- users/{authId}/persona/current: a new persona written elsewhere replaces
+  the cached entry immediately; a deleted one is evicted.
+
+A user document listener receives the whole document on every change, and
+for users whose chat history still lives in the `userHistory` array that is
+the full conversation again on every message. The user document is
+therefore only watched for users with `historyStorage: "messages"`; the
+others get the persona listener only, and a flag flip reaches their cached
+persona through the cache TTL (or the local invalidation on this replica).
+
+Listeners are started from a worker thread, in the background of the
+request that first asks for the user's persona. Listeners of idle users are
+stopped by a background task, and at most PERSONA_LISTENER_MAX users are
+watched at once (the least recently active are dropped first). Snapshot
+callbacks run on Firestore's watch threads; the persona cache is thread-safe.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from firestore_client import get_db
+from persona_cache import cache_persona, invalidate_persona
+from repository import storage
+from storage import persona_doc_ref, uses_messages_subcollection
+
+PERSONA_LISTENERS_ENABLED = os.getenv("PERSONA_LISTENERS", "false").lower() in ("1", "true", "yes")
+PERSONA_LISTENER_IDLE = float(os.getenv("PERSONA_LISTENER_IDLE", "900"))
+PERSONA_LISTENER_MAX = int(os.getenv("PERSONA_LISTENER_MAX", "500"))
+
+
+class _UserWatch:
+    """The two snapshot listeners held for one user"""
+
+    def __init__(self, authId):
+        self.authId = authId
+        self.last_seen = time.monotonic()
+        self.update_flag = None
+        self._persona_initial = True
+        self._watches = []
+
+    def subscribe(self, db):
+        """Start the listeners (blocking: reads the user's history layout first)"""
+        user_ref = db.collection("users").document(self.authId)
+        persona_ref = persona_doc_ref(user_ref)
+        self._watches = [persona_ref.on_snapshot(self._on_persona_snapshot)]
+        user_doc = user_ref.get(field_paths=["historyStorage"])
+        if uses_messages_subcollection(user_doc.to_dict() if user_doc.exists else None):
+            self._watches.append(user_ref.on_snapshot(self._on_user_snapshot))
+
+    def unsubscribe(self):
+        for watch in self._watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print(f"Error stopping persona listener for {self.authId}: {e}")
+        self._watches = []
+
+    def _on_user_snapshot(self, docs, changes, read_time):
+        for doc in docs:
+            flag = (doc.to_dict() or {}).get("updatePersona", True) if doc.exists else True
+            if flag and not self.update_flag:
+                invalidate_persona(self.authId)
+            self.update_flag = flag
+
+    def _on_persona_snapshot(self, docs, changes, read_time):
+        initial, self._persona_initial = self._persona_initial, False
+        for doc in docs:
+            if doc.exists:
+                cache_persona(self.authId, doc.to_dict())
+            elif not initial:
+                # On the first snapshot a missing doc may just mean the user
+                # still has a legacy auto-id persona; keep that cached entry
+                invalidate_persona(self.authId)
+
+
+class PersonaListenerRegistry:
+    """Starts listeners for recently active users and stops them when idle"""
+
+    def __init__(self, enabled=PERSONA_LISTENERS_ENABLED, idle_timeout=PERSONA_LISTENER_IDLE,
+                 max_users=PERSONA_LISTENER_MAX):
+        # Snapshot listeners only exist on the Firestore backend
+        self.enabled = enabled and storage.backend == "firestore"
+        self.idle_timeout = idle_timeout
+        self.max_users = max_users
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._reaper_task = None
+        self._subscribing = set()
+
+    async def start(self):
+        """Start the background task that stops idle listeners"""
+        if self.enabled and self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        """Stop the reaper and every active listener"""
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            try:
+                await self._reaper_task
+            except asyncio.CancelledError:
+                pass
+            self._reaper_task = None
+
+        with self._lock:
+            watches, self._watches = list(self._watches.values()), {}
+        for watch in watches:
+            watch.unsubscribe()
+
+    def touch(self, authId):
+        """
+        Mark a user as active, starting their listeners in a worker thread if
+        needed. Must be called from the event loop; does not block it.
+        """
+        if not self.enabled or not authId:
+            return
+
+        dropped = []
+        with self._lock:
+            watch = self._watches.get(authId)
+            if watch is not None:
+                watch.last_seen = time.monotonic()
+                return
+
+            while self._watches and len(self._watches) >= self.max_users:
+                oldest = min(self._watches.values(), key=lambda w: w.last_seen)
+                dropped.append(self._watches.pop(oldest.authId))
+
+            watch = _UserWatch(authId)
+            self._watches[authId] = watch
+
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._subscribe, watch, dropped))
+        # Keep a reference until the task is done
+        self._subscribing.add(task)
+        task.add_done_callback(self._subscribing.discard)
+
+    def _subscribe(self, watch, dropped):
+        for old in dropped:
+            old.unsubscribe()
+
+        try:
+            watch.subscribe(get_db())
+        except Exception as e:
+            print(f"Error starting persona listener for {watch.authId}: {e}")
+            with self._lock:
+                if self._watches.get(watch.authId) is watch:
+                    self._watches.pop(watch.authId)
+            watch.unsubscribe()
+            return
+
+        # Dropped or stopped while subscribing
+        with self._lock:
+            registered = self._watches.get(watch.authId) is watch
+        if not registered:
+            watch.unsubscribe()
+
+    def reap_idle(self):
+        """Stop listeners of users not seen for idle_timeout seconds"""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [authId for authId, watch in self._watches.items() if watch.last_seen < cutoff]
+            idle_watches = [self._watches.pop(authId) for authId in idle]
+        for watch in idle_watches:
+            watch.unsubscribe()
+        return len(idle_watches)
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "listening": len(self._watches), "max_users": self.max_users}
+
+    async def _reap_loop(self):
+        interval = max(30.0, self.idle_timeout / 4)
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                stopped = await asyncio.to_thread(self.reap_idle)
+                if stopped:
+                    print(f"Stopped persona listeners for {stopped} idle users")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Error reaping persona listeners: {e}")
+
+
+# Create a global instance of the listener registry
+persona_listeners = PersonaListenerRegistry()
@@ -0,0 +1,145 @@
+"""
+Token-budgeted prompt assembly.
+
+Prompt inputs are serialized as compact JSON (no indentation, no spaces
+after separators, non-ASCII kept as is), which costs noticeably fewer input
+tokens than json.dumps(..., indent=4) for the same data. When a prompt would
+exceed the task's input budget, the oldest history items are dropped (and
+replaced by a note saying how many were left out) until it fits; data that
+is too large on its own is cut at the end with a marker.
+
+Token counts are estimated locally (~4 characters per token), so no extra
+request is made before the real one. The size of every built prompt is
+recorded per task in `prompt_metrics`.
+"""
+import json
+import threading
+
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[... truncated to fit the input budget]"
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def compact_json(data):
+    """JSON without indentation or spaces after separators"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def serialize(data):
+    """Strings as they are, anything else as compact JSON"""
+    if data is None:
+        return ""
+    if isinstance(data, str):
+        return data
+    return compact_json(data)
+
+
+def truncate_text(text, budget):
+    """Cut text to roughly `budget` tokens, marking the cut"""
+    if budget is None or estimate_tokens(text) <= budget:
+        return text
+    limit = max(0, budget * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+    return text[:limit] + TRUNCATION_MARKER
+
+
+def fit_recent(items, budget, render=compact_json):
+    """
+    Keep the most recent items whose rendering fits in `budget` tokens.
+
+    Args:
+        items (list): Items in chronological order
+        budget (int): Token budget for the rendered items (None: keep all)
+        render: Serializes one item
+
+    Returns:
+        tuple: (kept items in chronological order, number of items dropped)
+    """
+    items = list(items)
+    if budget is None:
+        return items, 0
+    kept = []
+    used = 1  # brackets
+    for item in reversed(items):
+        tokens = estimate_tokens(render(item))
+        if used + tokens > budget:
+            break
+        kept.append(item)
+        used += tokens
+    kept.reverse()
+    return kept, len(items) - len(kept)
+
+
+class PromptMetrics:
+    """Per-task prompt size counters"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def record(self, task, tokens, dropped=0, truncated=False):
+        with self._lock:
+            metrics = self._metrics.setdefault(task or "unknown", {
+                "prompts": 0, "tokens": 0, "max_tokens": 0, "truncated": 0, "dropped_items": 0,
+            })
+            metrics["prompts"] += 1
+            metrics["tokens"] += tokens
+            metrics["max_tokens"] = max(metrics["max_tokens"], tokens)
+            metrics["dropped_items"] += dropped
+            if truncated or dropped:
+                metrics["truncated"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                task: {**metrics, "avg_tokens": metrics["tokens"] // metrics["prompts"]}
+                for task, metrics in self._metrics.items()
+            }
+
+
+# Create a global instance of the prompt metrics
+prompt_metrics = PromptMetrics()
+
+
+def build_prompt(task, instructions, data=None, history=None, budget=None, history_note="earlier messages"):
+    """
+    Assemble instructions, data and history into one prompt within a budget.
+
+    Args:
+        task (str): Task name, for the metrics
+        instructions (str): Prompt text placed first, never truncated
+        data: Input placed after the instructions (string or JSON-serializable)
+        history (list): Chronological items placed last; the oldest are
+            dropped first when over budget
+        budget (int): Maximum estimated prompt tokens (None for no limit)
+        history_note (str): What the dropped items are called in the note
+
+    Returns:
+        str: The prompt
+    """
+    prompt = instructions
+    remaining = None if budget is None else budget - estimate_tokens(instructions)
+    truncated = False
+    dropped = 0
+
+    if data is not None:
+        text = serialize(data)
+        if history is None:
+            fitted = truncate_text(text, remaining)
+            truncated = fitted is not text
+            text = fitted
+        prompt += text
+        if remaining is not None:
+            remaining -= estimate_tokens(text)
+
+    if history is not None:
+        kept, dropped = fit_recent(history, None if remaining is None else max(0, remaining - 20))
+        if dropped:
+            prompt += f"[{dropped} {history_note} omitted to fit the input budget]\n"
+        prompt += compact_json(kept)
+
+    prompt_metrics.record(task, estimate_tokens(prompt), dropped, truncated)
+    return prompt
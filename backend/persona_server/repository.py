@@ -0,0 +1,116 @@
+import asyncio
+
+from google.cloud import firestore
+from firestore_client import get_async_db, get_db
+from persona_cache import invalidate_persona
+from storage import (
+    create_storage,
+    legacy_persona_data,
+    legacy_persona_query,
+    persona_doc_ref,
+    stage_persona_write,
+)
+
+# Blocking storage backend (Firestore or SQLite, see storage.py) used by the
+# synchronous code paths and scripts
+storage = create_storage(firestore_client=get_db)
+
+
+class UserRepository:
+    """
+    Async data access for users/{authId}, its persona subcollection and its
+    journal entries, built on the shared Firestore AsyncClient so request
+    handlers can await reads without blocking the event loop.
+    """
+
+    def _user_ref(self, authId):
+        return get_async_db().collection("users").document(authId)
+
+    async def get_user(self, authId, field_paths=None):
+        """
+        Return the user document as a dict, or None if it does not exist.
+        Pass field_paths to download only those fields instead of the whole
+        document (which includes the ever-growing userHistory).
+        """
+        user_doc = await self._user_ref(authId).get(field_paths=field_paths)
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict()
+
+    async def update_user(self, authId, fields):
+        """Merge fields into the user document"""
+        await self._user_ref(authId).set(fields, merge=True)
+
+    async def get_persona(self, authId):
+        """Return the stored persona document (Info, Date, Watermark) as a dict, or None"""
+        user_ref = self._user_ref(authId)
+        persona_doc = await persona_doc_ref(user_ref).get()
+        if persona_doc.exists:
+            return persona_doc.to_dict() or None
+        return legacy_persona_data(await legacy_persona_query(user_ref).get())
+
+    async def write_persona(self, authId, newInfo, user_fields=None, watermark=None):
+        """
+        Atomically write the persona document and (optionally) fields of the
+        user document, e.g. the updatePersona flag, in one batch.
+
+        watermark records how much history the persona covers
+        ({"lastMessageIndex", "lastJournalUpdate", "fullRefreshAt"}) for
+        incremental refreshes.
+        """
+        batch = get_async_db().batch()
+        stage_persona_write(batch, self._user_ref(authId), newInfo, user_fields, watermark)
+        await batch.commit()
+        invalidate_persona(authId)
+
+    async def get_journal_entries(self, authId, limit, updated_since=None):
+        """
+        Return the latest `limit` journal entry snapshots, newest first.
+        With `updated_since`, only entries created or edited strictly after it
+        (by `updatedAt`) are returned, most recently updated first.
+        A `limit` of None returns every matching entry.
+        """
+        journal_ref = self._user_ref(authId).collection("journalEntries")
+        query = journal_ref
+        if updated_since is not None:
+            query = query.where(filter=firestore.FieldFilter("updatedAt", ">", updated_since))
+            query = query.order_by("updatedAt", direction=firestore.Query.DESCENDING)
+        else:
+            query = query.order_by("date", direction=firestore.Query.DESCENDING)
+        if limit is not None:
+            query = query.limit(limit)
+        return await query.get()
+
+
+class StorageRepository(UserRepository):
+    """
+    The UserRepository interface on top of a blocking storage backend (e.g.
+    SQLite for offline load tests); calls run in worker threads.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get_user(self, authId, field_paths=None):
+        return await asyncio.to_thread(self.storage.get_user, authId, field_paths)
+
+    async def update_user(self, authId, fields):
+        await asyncio.to_thread(self.storage.update_user, authId, fields)
+
+    async def get_persona(self, authId):
+        return await asyncio.to_thread(self.storage.get_persona, authId)
+
+    async def write_persona(self, authId, newInfo, user_fields=None, watermark=None):
+        await asyncio.to_thread(self.storage.write_persona, authId, newInfo, user_fields, watermark)
+        invalidate_persona(authId)
+
+    async def get_journal_entries(self, authId, limit, updated_since=None):
+        return await asyncio.to_thread(self.storage.get_journal_entries, authId, limit, updated_since)
+
+
+# Create a global instance of the user repository. Firestore is read through
+# the AsyncClient; other backends go through the blocking storage.
+if storage.backend == "firestore":
+    user_repository = UserRepository()
+else:
+    user_repository = StorageRepository(storage)
@@ -0,0 +1,596 @@
+"""
+Pluggable storage for user data: the user document, chat history, journal
+entries, the persona and the questionnaire state.
+
+Two backends implement the same interface:
+
+- FirestoreStorage (default): the production layout, users/{authId} with
+  the `journalEntries`, `persona` and `messages` subcollections.
+- SQLiteStorage: a local single-file database with the same data model, so
+  both servers can run and be load tested offline on one machine.
+
+The backend is chosen with STORAGE_BACKEND ("firestore" or "sqlite"); the
+SQLite file is STORAGE_SQLITE_PATH. Both servers must point at the same file
+to share data. cassidy_adk imports this module from persona_server (see
+cassidy_adk/next_ques_agent/__init__.py).
+
+Chat history: historically the whole conversation lives in the `userHistory`
+array on the user document. Users migrated with migrate_history.py keep their
+messages in an ordered `users/{authId}/messages` subcollection instead (one
+document per message, id = zero-padded index) and have
+`historyStorage: "messages"` on the user document. Anything still appended to
+the `userHistory` array after the migration is treated as the tail of the
+conversation. The web client rewrites the whole array, so a write based on a
+read from before the migration trimmed it puts the migrated messages back in
+front of the tail; `historyLastMigrated` records the last migrated message so
+that re-appended prefix is skipped (see history_tail). The SQLite backend
+always stores messages in their own table.
+"""
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+from google.cloud import firestore
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "soulscript.db")
+
+# Messages fetched per page when reading the messages subcollection
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "200"))
+
+MESSAGES_STORAGE = "messages"
+
+# User document field holding the last message moved by migrate_history.py
+LAST_MIGRATED_FIELD = "historyLastMigrated"
+
+# Persona data is stored in a single document with a fixed id, so writers can
+# address it directly (and batch it with other writes) without a read first.
+# Older users may still have their persona under an auto-generated id; it is
+# read as a fallback until the next update writes PERSONA_DOC_ID.
+PERSONA_DOC_ID = "current"
+
+
+def message_doc_id(index):
+    """Document id for the message at `index`; zero-padded so ids sort in order"""
+    return f"{index:08d}"
+
+
+def to_message_doc(index, entry):
+    """Stored document data for a userHistory entry at `index`"""
+    if isinstance(entry, dict):
+        return {**entry, "index": index}
+    return {"index": index, "value": entry}
+
+
+def from_message_doc(message):
+    """Inverse of to_message_doc: the original userHistory entry"""
+    message = dict(message)
+    message.pop("index", None)
+    if set(message) == {"value"}:
+        return message["value"]
+    return message
+
+
+def uses_messages_subcollection(user_data):
+    return (user_data or {}).get("historyStorage") == MESSAGES_STORAGE
+
+
+def history_tail(user_data):
+    """
+    The `userHistory` array of a user, without migrated messages a client
+    wrote back in front of it (everything up to the last occurrence of
+    `historyLastMigrated`; encrypted entries never repeat).
+    """
+    user_data = user_data or {}
+    tail = user_data.get("userHistory") or []
+    last_migrated = user_data.get(LAST_MIGRATED_FIELD)
+    if last_migrated is None or not uses_messages_subcollection(user_data):
+        return tail
+    for position in range(len(tail) - 1, -1, -1):
+        if tail[position] == last_migrated:
+            return tail[position + 1:]
+    return tail
+
+
+def history_length(user_data):
+    """Total number of messages in the user's history, without reading it"""
+    user_data = user_data or {}
+    tail = history_tail(user_data)
+    if not uses_messages_subcollection(user_data):
+        return len(tail)
+    return user_data.get("historyMessageCount", 0) + len(tail)
+
+
+def persona_doc_ref(user_ref):
+    """
+    The fixed persona document under a user document. The persona helpers
+    take sync or async Firestore references, so FirestoreStorage and the
+    async repository share one layout.
+    """
+    return user_ref.collection("persona").document(PERSONA_DOC_ID)
+
+
+def legacy_persona_query(user_ref):
+    """Legacy layout: the persona stored under an auto-generated document id"""
+    return user_ref.collection("persona").limit(1)
+
+
+def legacy_persona_data(doc_snapshots):
+    """The persona dict of a legacy_persona_query result, or None"""
+    if not doc_snapshots:
+        return None
+    return doc_snapshots[0].to_dict() or None
+
+
+def stage_persona_write(batch, user_ref, newInfo, user_fields=None, watermark=None):
+    """Add the persona write and (optionally) user document fields to a batch"""
+    persona_fields = {"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP}
+    if watermark is not None:
+        persona_fields["Watermark"] = watermark
+    batch.set(persona_doc_ref(user_ref), persona_fields, merge=True)
+    if user_fields:
+        batch.set(user_ref, user_fields, merge=True)
+
+
+class StoredDocument:
+    """
+    A stored record with the parts of the Firestore DocumentSnapshot API the
+    servers use (`id`, `exists`, `to_dict()`), so callers work with either backend
+    """
+
+    def __init__(self, id, data):
+        self.id = id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class Storage(ABC):
+    """Interface implemented by every storage backend"""
+
+    backend = None
+
+    @abstractmethod
+    def get_user(self, authId, field_paths=None):
+        """
+        Return the user document as a dict, or None if it does not exist.
+        With field_paths only those fields are returned.
+        """
+
+    @abstractmethod
+    def update_user(self, authId, fields, must_exist=False):
+        """
+        Merge `fields` into the user document. With must_exist the write
+        fails (KeyError / NotFound) instead of creating a missing user.
+        """
+
+    @abstractmethod
+    def load_history(self, authId, user_data, start_index=0, page_size=HISTORY_PAGE_SIZE):
+        """
+        Return the user's (still encrypted) chat history as a list, skipping
+        the messages before start_index.
+        """
+
+    @abstractmethod
+    def append_history(self, authId, entries):
+        """Append entries to the end of the user's chat history"""
+
+    @abstractmethod
+    def get_journal_entries(self, authId, limit, updated_since=None):
+        """
+        Return the latest `limit` journal entries (StoredDocument-like), newest
+        first. With `updated_since`, only entries created or edited strictly
+        after it (by `updatedAt`) are returned, most recently updated first.
+        A `limit` of None returns every matching entry.
+        """
+
+    @abstractmethod
+    def add_journal_entry(self, authId, entry_id, data):
+        """Create or replace one journal entry"""
+
+    @abstractmethod
+    def update_journal_entry(self, authId, entry_id, fields):
+        """Merge fields into an existing journal entry"""
+
+    @abstractmethod
+    def get_persona(self, authId):
+        """Return the stored persona document (Info, Date, Watermark) as a dict, or None"""
+
+    @abstractmethod
+    def write_persona(self, authId, newInfo, user_fields=None, watermark=None):
+        """
+        Atomically write the persona and (optionally) fields of the user
+        document, e.g. the updatePersona flag.
+        """
+
+    def get_current_question(self, authId):
+        user_data = self.get_user(authId, field_paths=["currentQuestion"])
+        return (user_data or {}).get("currentQuestion")
+
+    def set_current_question(self, authId, question, must_exist=False):
+        self.update_user(authId, {"currentQuestion": question}, must_exist=must_exist)
+
+    def update_progress(self, authId, progress):
+        self.update_user(authId, {"progress": progress}, must_exist=True)
+
+    def close(self):
+        pass
+
+
+class FirestoreStorage(Storage):
+    """
+    Storage on Cloud Firestore. `client_factory` returns the Firestore
+    client to use, so each server keeps control of how clients are created
+    and pooled.
+    """
+
+    backend = "firestore"
+
+    def __init__(self, client_factory):
+        self.client_factory = client_factory
+
+    def _user_ref(self, authId):
+        return self.client_factory().collection("users").document(authId)
+
+    def get_user(self, authId, field_paths=None):
+        user_doc = self._user_ref(authId).get(field_paths=field_paths)
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict()
+
+    def update_user(self, authId, fields, must_exist=False):
+        if must_exist:
+            self._user_ref(authId).update(fields)
+        else:
+            self._user_ref(authId).set(fields, merge=True)
+
+    def iter_history_pages(self, authId, page_size=HISTORY_PAGE_SIZE, start_after_index=None):
+        """
+        Yield pages (lists of message dicts) from the messages subcollection,
+        in conversation order, using a cursor on the `index` field.
+        """
+        messages_ref = self._user_ref(authId).collection("messages")
+        last_index = start_after_index
+
+        while True:
+            query = messages_ref.order_by("index").limit(page_size)
+            if last_index is not None:
+                query = query.start_after({"index": last_index})
+
+            page = [doc.to_dict() for doc in query.stream()]
+            if not page:
+                return
+
+            yield page
+            if len(page) < page_size:
+                return
+            last_index = page[-1]["index"]
+
+    def load_history(self, authId, user_data, start_index=0, page_size=HISTORY_PAGE_SIZE):
+        user_data = user_data or {}
+        tail = history_tail(user_data)
+        if not uses_messages_subcollection(user_data):
+            return tail[start_index:]
+
+        stored_count = user_data.get("historyMessageCount", 0)
+        if start_index >= stored_count:
+            return tail[start_index - stored_count:]
+
+        history = []
+        start_after_index = start_index - 1 if start_index > 0 else None
+        for page in self.iter_history_pages(authId, page_size, start_after_index):
+            history.extend(from_message_doc(message) for message in page)
+        return history + tail
+
+    def append_history(self, authId, entries):
+        # Same write the web client makes; messages-mode users keep new
+        # entries in the array tail until the next migrate_history.py run
+        self._user_ref(authId).set({"userHistory": firestore.ArrayUnion(list(entries))}, merge=True)
+
+    def get_journal_entries(self, authId, limit, updated_since=None):
+        query = self._user_ref(authId).collection("journalEntries")
+        if updated_since is not None:
+            query = query.where(filter=firestore.FieldFilter("updatedAt", ">", updated_since))
+            query = query.order_by("updatedAt", direction=firestore.Query.DESCENDING)
+        else:
+            query = query.order_by("date", direction=firestore.Query.DESCENDING)
+        if limit is not None:
+            query = query.limit(limit)
+        return list(query.stream())
+
+    def add_journal_entry(self, authId, entry_id, data):
+        self._user_ref(authId).collection("journalEntries").document(entry_id).set(data)
+
+    def update_journal_entry(self, authId, entry_id, fields):
+        self._user_ref(authId).collection("journalEntries").document(entry_id).update(fields)
+
+    def get_persona(self, authId):
+        user_ref = self._user_ref(authId)
+        persona_doc = persona_doc_ref(user_ref).get()
+        if persona_doc.exists:
+            return persona_doc.to_dict() or None
+        return legacy_persona_data(legacy_persona_query(user_ref).get())
+
+    def write_persona(self, authId, newInfo, user_fields=None, watermark=None):
+        batch = self.client_factory().batch()
+        stage_persona_write(batch, self._user_ref(authId), newInfo, user_fields, watermark)
+        batch.commit()
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": _to_utc(value).isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_object(obj):
+    if set(obj) == {"__datetime__"}:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _to_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _sortable_date(value):
+    """Fixed-width UTC ISO timestamp, so dates compare correctly as text"""
+    return _to_utc(value).isoformat(timespec="microseconds")
+
+
+def _dumps(data):
+    return json.dumps(data, default=_encode_value)
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode_object)
+
+
+def _project(data, field_paths):
+    """Keep only the (possibly dotted) field paths of a document"""
+    projected = {}
+    for path in field_paths:
+        source, target = data, projected
+        parts = path.split(".")
+        for part in parts[:-1]:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    return projected
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage in a local SQLite file with the same data model as Firestore.
+
+    Documents are stored as JSON (datetimes round-trip), history messages and
+    journal entries get their own tables so they can be paged and ordered.
+    Each thread uses its own connection; WAL mode lets the two servers and
+    the worker threads read while one of them writes.
+    """
+
+    backend = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            auth_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            auth_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (auth_id, idx)
+        );
+        CREATE TABLE IF NOT EXISTS journal_entries (
+            auth_id TEXT NOT NULL,
+            entry_id TEXT NOT NULL,
+            date TEXT,
+            updated_at TEXT,
+            data TEXT NOT NULL,
+            PRIMARY KEY (auth_id, entry_id)
+        );
+        CREATE INDEX IF NOT EXISTS journal_entries_by_date ON journal_entries (auth_id, date);
+        CREATE TABLE IF NOT EXISTS personas (
+            auth_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path=STORAGE_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        # Files created before journal entries tracked their last edit
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(journal_entries)")}
+        if "updated_at" not in columns:
+            conn.execute("ALTER TABLE journal_entries ADD COLUMN updated_at TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS journal_entries_by_update ON journal_entries (auth_id, updated_at)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._connection())
+
+    def _read_user(self, conn, authId):
+        row = conn.execute("SELECT data FROM users WHERE auth_id = ?", (authId,)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def _merge_user(self, conn, authId, fields, must_exist=False):
+        user_data = self._read_user(conn, authId)
+        if user_data is None:
+            if must_exist:
+                raise KeyError(f"User {authId} not found")
+            user_data = {}
+        user_data.update(fields)
+        conn.execute(
+            "INSERT INTO users (auth_id, data) VALUES (?, ?) "
+            "ON CONFLICT(auth_id) DO UPDATE SET data = excluded.data",
+            (authId, _dumps(user_data)),
+        )
+
+    def get_user(self, authId, field_paths=None):
+        user_data = self._read_user(self._connection(), authId)
+        if user_data is None or field_paths is None:
+            return user_data
+        return _project(user_data, field_paths)
+
+    def update_user(self, authId, fields, must_exist=False):
+        with self._transaction() as conn:
+            self._merge_user(conn, authId, fields, must_exist)
+
+    def load_history(self, authId, user_data, start_index=0, page_size=HISTORY_PAGE_SIZE):
+        rows = self._connection().execute(
+            "SELECT data FROM messages WHERE auth_id = ? AND idx >= ? ORDER BY idx",
+            (authId, start_index),
+        ).fetchall()
+        return [from_message_doc(_loads(row[0])) for row in rows]
+
+    def append_history(self, authId, entries):
+        with self._transaction() as conn:
+            user_data = self._read_user(conn, authId) or {}
+            first_index = user_data.get("historyMessageCount", 0)
+            entries = list(entries)
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (auth_id, idx, data) VALUES (?, ?, ?)",
+                [
+                    (authId, first_index + offset, _dumps(to_message_doc(first_index + offset, entry)))
+                    for offset, entry in enumerate(entries)
+                ],
+            )
+            self._merge_user(conn, authId, {
+                "historyStorage": MESSAGES_STORAGE,
+                "historyMessageCount": first_index + len(entries),
+            })
+
+    def get_journal_entries(self, authId, limit, updated_since=None):
+        query = "SELECT entry_id, data FROM journal_entries WHERE auth_id = ?"
+        params = [authId]
+        if updated_since is not None:
+            query += " AND updated_at > ? ORDER BY updated_at DESC"
+            params.append(_sortable_date(updated_since))
+        else:
+            query += " ORDER BY date DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._connection().execute(query, params).fetchall()
+        return [StoredDocument(entry_id, _loads(data)) for entry_id, data in rows]
+
+    def add_journal_entry(self, authId, entry_id, data):
+        date = data.get("date")
+        updated_at = data.get("updatedAt")
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO journal_entries (auth_id, entry_id, date, updated_at, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (authId, entry_id, _sortable_date(date) if date else None,
+                 _sortable_date(updated_at) if updated_at else None, _dumps(data)),
+            )
+
+    def update_journal_entry(self, authId, entry_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM journal_entries WHERE auth_id = ? AND entry_id = ?", (authId, entry_id)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Journal entry {entry_id} not found")
+            data = _loads(row[0])
+            data.update(fields)
+            updated_at = data.get("updatedAt")
+            conn.execute(
+                "UPDATE journal_entries SET updated_at = ?, data = ? WHERE auth_id = ? AND entry_id = ?",
+                (_sortable_date(updated_at) if updated_at else None, _dumps(data), authId, entry_id),
+            )
+
+    def get_persona(self, authId):
+        row = self._connection().execute("SELECT data FROM personas WHERE auth_id = ?", (authId,)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def write_persona(self, authId, newInfo, user_fields=None, watermark=None):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM personas WHERE auth_id = ?", (authId,)).fetchone()
+            persona = _loads(row[0]) if row else {}
+            persona.update({"Info": newInfo, "Date": datetime.now(timezone.utc)})
+            if watermark is not None:
+                persona["Watermark"] = watermark
+            conn.execute(
+                "INSERT OR REPLACE INTO personas (auth_id, data) VALUES (?, ?)",
+                (authId, _dumps(persona)),
+            )
+            if user_fields:
+                self._merge_user(conn, authId, user_fields)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"Error closing SQLite connection: {e}")
+
+
+class _SQLiteTransaction:
+    """Context manager running a block in one write transaction (BEGIN IMMEDIATE)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def create_storage(backend=None, firestore_client=None, sqlite_path=None):
+    """
+    Create the configured storage backend.
+
+    Args:
+        backend (str): "firestore" or "sqlite" (default: STORAGE_BACKEND)
+        firestore_client (callable): Returns the Firestore client to use
+        sqlite_path (str): SQLite database file (default: STORAGE_SQLITE_PATH)
+    """
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path or STORAGE_SQLITE_PATH)
+    if backend == "firestore":
+        if firestore_client is None:
+            raise ValueError("The firestore backend needs a firestore_client factory")
+        return FirestoreStorage(firestore_client)
+    raise ValueError(f"Unknown storage backend: {backend}")
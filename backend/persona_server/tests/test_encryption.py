@@ -0,0 +1,103 @@
+import pytest
+
+import encryption
+from encryption import (
+    HISTORY_DECRYPT_PLACEHOLDER,
+    create_data_key,
+    decrypt,
+    decrypt_history,
+    decrypt_many,
+    encrypt,
+    is_v2,
+)
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture
+def data_key():
+    key_id, wrapped_key = create_data_key(EMAIL)
+    return key_id, {key_id: wrapped_key}
+
+
+def test_v1_round_trip():
+    value = encrypt("hello", EMAIL)
+    assert not is_v2(value)
+    assert decrypt(value, EMAIL) == "hello"
+
+
+def test_v2_round_trip(data_key):
+    key_id, data_keys = data_key
+    value = encrypt("hello", EMAIL, data_keys, key_id)
+    assert is_v2(value)
+    assert key_id in value
+    assert decrypt(value, EMAIL, data_keys) == "hello"
+
+
+def test_v2_data_key_unwraps_after_cache_clear(data_key):
+    key_id, data_keys = data_key
+    value = encrypt("hello", EMAIL, data_keys, key_id)
+    encryption.data_key_cache.clear()
+    encryption.key_cache.clear()
+    assert decrypt(value, EMAIL, data_keys) == "hello"
+
+
+def test_v2_needs_the_data_keys(data_key):
+    key_id, data_keys = data_key
+    value = encrypt("hello", EMAIL, data_keys, key_id)
+    with pytest.raises(Exception):
+        decrypt(value, EMAIL)
+
+
+def test_wrong_key_fails():
+    with pytest.raises(Exception):
+        decrypt(encrypt("hello", EMAIL), "other@example.com")
+
+
+def test_empty_key_is_rejected():
+    with pytest.raises(ValueError):
+        encrypt("hello", "")
+    with pytest.raises(ValueError):
+        create_data_key("")
+
+
+@pytest.mark.parametrize("count", [3, encryption.DECRYPT_PARALLEL_MIN + 2])
+def test_decrypt_many_mixed_formats_keeps_order(data_key, count):
+    key_id, data_keys = data_key
+    values = [
+        encrypt(f"m{index}", EMAIL, data_keys, key_id) if index % 2 else encrypt(f"m{index}", EMAIL)
+        for index in range(count)
+    ]
+    assert decrypt_many(values, EMAIL, data_keys=data_keys) == [f"m{index}" for index in range(count)]
+
+
+def test_decrypt_many_list_fallback_is_per_item():
+    values = [encrypt("a", EMAIL), "not encrypted", encrypt("c", EMAIL)]
+    assert decrypt_many(values, EMAIL, fallback=["fa", "fb", "fc"]) == ["a", "fb", "c"]
+    assert decrypt_many(values, EMAIL, fallback=[None] * 3) == ["a", None, "c"]
+    assert decrypt_many(values, EMAIL, fallback="?") == ["a", "?", "c"]
+
+
+def test_decrypt_many_raises_without_fallback():
+    with pytest.raises(Exception):
+        decrypt_many([encrypt("a", EMAIL), "not encrypted"], EMAIL)
+
+
+def test_decrypt_many_empty():
+    assert decrypt_many([], EMAIL, fallback=[]) == []
+
+
+def test_decrypt_history(data_key):
+    key_id, data_keys = data_key
+    history = [
+        {"encryptedMessage": encrypt("hi", EMAIL), "role": "user"},
+        {"encryptedMessage": encrypt("hello", EMAIL, data_keys, key_id), "role": "model"},
+        {"encryptedMessage": "broken", "role": "user"},
+        "legacy entry",
+    ]
+    assert decrypt_history(history, EMAIL, data_keys) == [
+        {"message": "hi", "role": "user"},
+        {"message": "hello", "role": "model"},
+        {"message": HISTORY_DECRYPT_PLACEHOLDER, "role": "user"},
+        "legacy entry",
+    ]
@@ -0,0 +1,202 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import storage
+from storage import (
+    LAST_MIGRATED_FIELD,
+    MESSAGES_STORAGE,
+    SQLiteStorage,
+    Storage,
+    history_length,
+    history_tail,
+)
+
+NOW = datetime(2026, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def store(tmp_path):
+    sqlite_storage = SQLiteStorage(str(tmp_path / "test.db"))
+    yield sqlite_storage
+    sqlite_storage.close()
+
+
+def test_incomplete_backend_fails_on_creation():
+    class PartialStorage(Storage):
+        def get_user(self, authId, field_paths=None):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStorage()
+
+
+def test_user_round_trip_keeps_datetimes(store):
+    store.update_user("u1", {"email": "a@example.com", "createdAt": NOW, "nested": {"when": NOW}})
+
+    user = store.get_user("u1")
+    assert user["createdAt"] == NOW
+    assert user["createdAt"].tzinfo is not None
+    assert user["nested"] == {"when": NOW}
+
+
+def test_naive_datetimes_are_stored_as_utc(store):
+    store.update_user("u1", {"at": datetime(2026, 5, 1, 12, 0)})
+    assert store.get_user("u1")["at"] == datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_get_user_projects_field_paths(store):
+    store.update_user("u1", {"updatePersona": True, "email": "a@example.com", "progress": {"done": 3, "total": 9}})
+
+    assert store.get_user("u1", field_paths=["updatePersona", "progress.done"]) == {
+        "updatePersona": True,
+        "progress": {"done": 3},
+    }
+    assert store.get_user("missing") is None
+
+
+def test_update_user_merges_and_must_exist(store):
+    store.update_user("u1", {"a": 1})
+    store.update_user("u1", {"b": 2}, must_exist=True)
+    assert store.get_user("u1") == {"a": 1, "b": 2}
+
+    with pytest.raises(KeyError):
+        store.update_user("missing", {"a": 1}, must_exist=True)
+    assert store.get_user("missing") is None
+
+
+def test_update_progress_needs_an_existing_user(store):
+    with pytest.raises(KeyError):
+        store.update_progress("missing", {"done": 1})
+
+
+def test_transaction_rolls_back_on_error(store):
+    store.update_user("u1", {"a": 1})
+
+    with pytest.raises(RuntimeError):
+        with store._transaction() as conn:
+            store._merge_user(conn, "u1", {"a": 2})
+            raise RuntimeError("boom")
+
+    assert store.get_user("u1") == {"a": 1}
+
+
+def test_transaction_commits(store):
+    with store._transaction() as conn:
+        store._merge_user(conn, "u1", {"a": 1})
+        store._merge_user(conn, "u1", {"b": 2})
+
+    assert store.get_user("u1") == {"a": 1, "b": 2}
+
+
+def test_history_is_appended_and_paged(store):
+    store.append_history("u1", [{"encryptedMessage": "m0", "role": "user"}, "m1"])
+    store.append_history("u1", [{"encryptedMessage": "m2", "role": "model"}])
+
+    user = store.get_user("u1")
+    assert user["historyStorage"] == MESSAGES_STORAGE
+    assert user["historyMessageCount"] == 3
+    assert history_length(user) == 3
+    assert store.load_history("u1", user) == [
+        {"encryptedMessage": "m0", "role": "user"},
+        "m1",
+        {"encryptedMessage": "m2", "role": "model"},
+    ]
+    assert store.load_history("u1", user, start_index=2) == [{"encryptedMessage": "m2", "role": "model"}]
+
+
+def test_journal_entries_by_date_and_by_update(store):
+    store.add_journal_entry("u1", "old-edited", {"date": NOW - timedelta(days=30), "updatedAt": NOW})
+    store.add_journal_entry("u1", "new", {"date": NOW, "updatedAt": NOW - timedelta(days=2)})
+    store.add_journal_entry("u1", "legacy", {"date": NOW - timedelta(days=60)})
+
+    assert [doc.id for doc in store.get_journal_entries("u1", 5)] == ["new", "old-edited", "legacy"]
+    assert [doc.id for doc in store.get_journal_entries("u1", 1)] == ["new"]
+
+    since = NOW - timedelta(days=1)
+    assert [doc.id for doc in store.get_journal_entries("u1", 5, updated_since=since)] == ["old-edited"]
+
+    store.update_journal_entry("u1", "new", {"updatedAt": NOW + timedelta(seconds=1)})
+    updated = store.get_journal_entries("u1", 5, updated_since=since)
+    assert [doc.id for doc in updated] == ["new", "old-edited"]
+    assert updated[0].to_dict()["updatedAt"] == NOW + timedelta(seconds=1)
+
+
+def test_journal_entries_without_limit(store):
+    for position in range(8):
+        store.add_journal_entry("u1", f"e{position}", {"date": NOW, "updatedAt": NOW + timedelta(minutes=position)})
+
+    assert len(store.get_journal_entries("u1", None)) == 8
+    updated = store.get_journal_entries("u1", None, updated_since=NOW)
+    assert [doc.id for doc in updated] == [f"e{position}" for position in range(7, 0, -1)]
+
+
+def test_update_journal_entry_requires_the_entry(store):
+    with pytest.raises(KeyError):
+        store.update_journal_entry("u1", "missing", {"x": 1})
+
+
+def test_journal_update_column_is_added_to_old_files(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE journal_entries (auth_id TEXT NOT NULL, entry_id TEXT NOT NULL, date TEXT, "
+        "data TEXT NOT NULL, PRIMARY KEY (auth_id, entry_id))"
+    )
+    conn.close()
+
+    old_store = SQLiteStorage(path)
+    old_store.add_journal_entry("u1", "e1", {"date": NOW, "updatedAt": NOW})
+    assert [doc.id for doc in old_store.get_journal_entries("u1", 5, updated_since=NOW - timedelta(days=1))] == ["e1"]
+    old_store.close()
+
+
+def test_persona_write_is_atomic_with_user_fields(store):
+    watermark = {"lastMessageIndex": 4, "lastJournalUpdate": NOW, "fullRefreshAt": NOW}
+    store.write_persona("u1", '{"Info": {}}', {"updatePersona": False}, watermark)
+
+    persona = store.get_persona("u1")
+    assert persona["Info"] == '{"Info": {}}'
+    assert persona["Watermark"] == watermark
+    assert isinstance(persona["Date"], datetime)
+    assert store.get_user("u1") == {"updatePersona": False}
+
+    # A write without a watermark keeps the previous one
+    store.write_persona("u1", '{"Info": {"a": 1}}')
+    assert store.get_persona("u1")["Watermark"] == watermark
+    assert store.get_persona("missing") is None
+
+
+def test_current_question(store):
+    store.set_current_question("u1", {"id": 3})
+    assert store.get_current_question("u1") == {"id": 3}
+    assert store.get_current_question("missing") is None
+
+
+def test_history_tail_skips_reappended_migrated_messages():
+    user = {
+        "historyStorage": MESSAGES_STORAGE,
+        "historyMessageCount": 3,
+        LAST_MIGRATED_FIELD: "c",
+        "userHistory": ["a", "b", "c", "d", "e"],
+    }
+    assert history_tail(user) == ["d", "e"]
+    assert history_length(user) == 5
+
+    user["userHistory"] = ["d"]
+    assert history_tail(user) == ["d"]
+    assert history_length(user) == 4
+
+
+def test_history_tail_ignores_the_marker_for_array_users():
+    user = {LAST_MIGRATED_FIELD: "b", "userHistory": ["a", "b", "c"]}
+    assert history_tail(user) == ["a", "b", "c"]
+    assert history_length(user) == 3
+
+
+def test_create_storage():
+    with pytest.raises(ValueError):
+        storage.create_storage("firestore")
+    with pytest.raises(ValueError):
+        storage.create_storage("unknown")
@@ -0,0 +1,119 @@
+from repository import user_repository
+from persona_cache import CachedPersona, cache_persona, get_cached_persona
+from persona_listeners import persona_listeners
+
+
+class UserUnitOfWork:
+    """
+    Request-scoped view of users/{authId}.
+
+    The user document is fetched once by load() and the snapshot is shared by
+    everything that runs during the request (update flag, chat history,
+    journal decryption, persona). Writes are staged and committed together in
+    a single Firestore batch by commit().
+    """
+
+    def __init__(self, authId, repository=user_repository):
+        self.authId = authId
+        self.repository = repository
+        self.user_data = None
+        self._loaded = False
+        self._loaded_fields = None
+        self._persona = None
+        self._user_updates = {}
+        self._persona_update = None
+        self._persona_watermark = None
+
+    async def load(self, field_paths=None):
+        """
+        Read the user document once; later calls return the same snapshot.
+
+        With field_paths only those fields are fetched. A later call that
+        needs more fields (or the full document) reads it again once.
+        """
+        if self._loaded:
+            if self._loaded_fields is None:
+                return self.user_data
+            if field_paths is not None and set(field_paths) <= self._loaded_fields:
+                return self.user_data
+
+        user_data = await self.repository.get_user(self.authId, field_paths=field_paths)
+        if user_data is not None:
+            # Keep staged updates visible on the fresh snapshot
+            user_data.update(self._user_updates)
+        self.user_data = user_data
+        self._loaded = True
+        self._loaded_fields = set(field_paths) if field_paths is not None else None
+        return self.user_data
+
+    @property
+    def exists(self):
+        return self.user_data is not None
+
+    def is_persona_update_needed(self):
+        if self.user_data is None:
+            return True
+        return self.user_data.get("updatePersona", True)
+
+    async def _get_cached_persona(self):
+        """
+        Return the CachedPersona from the in-process cache, reading Firestore
+        at most once per request on a miss
+        """
+        if self._persona is None:
+            # Keep this user's cache entry pushed fresh while they are active
+            persona_listeners.touch(self.authId)
+            self._persona = get_cached_persona(self.authId)
+        if self._persona is None:
+            document = await self.repository.get_persona(self.authId)
+            self._persona = cache_persona(self.authId, document)
+        return self._persona
+
+    async def get_persona(self):
+        """Return the stored persona document"""
+        persona = await self._get_cached_persona()
+        return persona.document if persona else None
+
+    async def get_persona_info(self):
+        """Return the stored persona JSON string"""
+        persona = await self._get_cached_persona()
+        return persona.info if persona else None
+
+    async def get_persona_data(self):
+        """Return the parsed persona ({"Info": ..., "Graph": ...}) or None"""
+        persona = await self._get_cached_persona()
+        return persona.parsed if persona else None
+
+    def update_user(self, fields):
+        """Stage a merge-write to the user document"""
+        self._user_updates.update(fields)
+        if self.user_data is not None:
+            self.user_data.update(fields)
+
+    def set_persona_info(self, newInfo, watermark=None):
+        """Stage a write of the persona Info field (and its history watermark)"""
+        self._persona_update = newInfo
+        self._persona_watermark = watermark
+        # Visible to this request now; the shared cache is only filled on commit
+        self._persona = CachedPersona({"Info": newInfo, "Watermark": watermark})
+
+    async def commit(self):
+        """
+        Write all staged changes in one atomic batch; no-op if nothing is staged.
+        The persona goes to its fixed document id, so no read is needed first.
+        """
+        if not self._user_updates and self._persona_update is None:
+            return
+
+        if self._persona_update is not None:
+            await self.repository.write_persona(
+                self.authId, self._persona_update, self._user_updates, self._persona_watermark
+            )
+            # The repository invalidated the cached persona; refill it
+            cache_persona(self.authId, self._persona.document)
+        else:
+            await self.repository.update_user(self.authId, self._user_updates)
+
+        self._user_updates = {}
+        self._persona_update = None
+        self._persona_watermark = None